@@ -1,11 +1,27 @@
+import multiprocessing as mp
 import sys
+from multiprocessing import shared_memory
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from sync_cache import getChromSnpIndices, loadSyncCache
 
 
 inFileName = "/proj/dschridelab/drosophila/simulansEAndR/Dsim_F0-F60_Q20_polymorphic_CMH_FET_blockID.sync"
+syncCacheDir = None  # if set, counts are read from this cache made by sync_cache.py instead of parsing inFileName
 outDir = "/proj/dschridelab/drosophila/simulansEAndR/aftInputsVelocity/"
 winSize = 51
-targetChrom = sys.argv[1]
+numWorkers = 10  # reps are encoded and written in parallel, one rep per worker process
+# 1: materialized (snps, gens, winSize) windows in aftIn/aftInPosition, as always written by this script
+# 2: (gens, snps) freqs in aftFreqs/aftPositions that are windowed on load, 51x smaller but only read by
+#    find_sweeps_npz.py and 5_makeComparisonFile.py, so anything else reading aftIn/aftInPosition needs version 1
+npzFormatVersion = 1
+encodingMode = "velocity"  # how the winning allele is picked: "final" freq or "velocity" (final - initial freq)
+# how freqs are stored: "float64", "float16", or "uint8" quantized to 1/254 steps (finer than the 1/200 sampling resolution),
+# in which case the scale to multiply them by is saved as freqScale and 255 marks missing (nan) freqs
+freqStorage = "float64"
+# chromosomes to convert; if none are given every chromosome in the sync file is converted in one pass
+targetChroms = sys.argv[1:]
 
 
 def getRepAndGen(headerEntry):
@@ -18,139 +34,185 @@ def getRepAndGen(headerEntry):
     return rep, gen
 
 
-def getFreqs(baseCounts):
-    aCount, tCount, cCount, gCount, nCount, delCount = [
-        int(x) for x in baseCounts.split(":")
-    ]
-    counts = [aCount, tCount, cCount, gCount, delCount]
-    denom = sum(counts)
+def getCounts(baseCountFields):
+    # A:T:C:G:N:del count strings for every sample -> (samples, 6) array
+    countStr = " ".join(baseCountFields).replace(":", " ")
+    return np.fromstring(countStr, dtype=np.uint32, sep=" ").reshape(-1, 6)
 
-    return [x / denom for x in counts]
 
+def getFreqs(baseCounts):
+    # (..., 6) A:T:C:G:N:del counts -> (..., 5) freqs of A, T, C, G and del, ignoring N
+    counts = baseCounts[..., [0, 1, 2, 3, 5]].astype(np.float64)
+    denom = counts.sum(axis=-1, keepdims=True)
 
-def getWinningAlleleIndex(allFreqsForSnp, mode="final"):
-    assert allFreqsForSnp.shape == (7, 5)  # 7 timepoints X freqs for 5 possible alleles
+    return counts / denom
 
-    freqScores = []
-    for alleleIndex in range(allFreqsForSnp.shape[1]):
-        if mode == "final":
-            freqScore = allFreqsForSnp[-1][alleleIndex]
-        elif mode == "velocity":
-            freqScore = allFreqsForSnp[-1][alleleIndex] - allFreqsForSnp[0][alleleIndex]
-        freqScores.append(freqScore)
 
-    return np.argmax(freqScores)
+def getWinningAlleleIndex(allFreqs, mode="final"):
+    assert allFreqs.ndim == 3 and allFreqs.shape[2] == 5  # snps X timepoints X freqs for 5 possible alleles
 
+    if mode == "final":
+        freqScores = allFreqs[:, -1]
+    elif mode == "velocity":
+        freqScores = allFreqs[:, -1] - allFreqs[:, 0]
+    else:
+        raise ValueError(f"unknown encoding mode: {mode}")
 
-def getMostCommonOtherAlleleIndex(allFreqsForSnp, winningAlleleIndex):
-    assert allFreqsForSnp.shape == (7, 5)  # 7 timepoints X freqs for 5 possible alleles
+    return np.argmax(freqScores, axis=1)
 
-    totalFreqs = []
-    for alleleIndex in range(allFreqsForSnp.shape[1]):
-        if alleleIndex == winningAlleleIndex:
-            totalFreqs.append(-1)
-        else:
-            totalFreq = sum(allFreqsForSnp[:, alleleIndex])
-            totalFreqs.append(totalFreq)
 
-    return np.argmax(totalFreqs)
+def getMostCommonOtherAlleleIndex(allFreqs, winningAlleleIndex):
+    assert allFreqs.ndim == 3 and allFreqs.shape[2] == 5  # snps X timepoints X freqs for 5 possible alleles
 
+    totalFreqs = allFreqs.sum(axis=1)
+    totalFreqs[np.arange(len(totalFreqs)), winningAlleleIndex] = -1
 
-def encodeFreqsInPlace(freqArray):
-    for snpIndex in range(len(freqArray[0])):
-        allFreqsForSnp = []
+    return np.argmax(totalFreqs, axis=1)
 
-        for gen in range(len(freqArray)):
-            freqs = freqArray[gen][snpIndex]
-            allFreqsForSnp.append(freqs)
 
-        allFreqsForSnp = np.array(allFreqsForSnp)
-        winningAlleleIndex = getWinningAlleleIndex(allFreqsForSnp, mode="velocity")
-        otherAlleleIndex = getMostCommonOtherAlleleIndex(
-            allFreqsForSnp, winningAlleleIndex
-        )
+def encodeFreqs(allFreqs, mode="final"):
+    # (snps, gens, 5) allele freqs -> (gens, snps) freq of the winning allele relative to the most common other allele
+    winningAlleleIndex = getWinningAlleleIndex(allFreqs, mode=mode)
+    otherAlleleIndex = getMostCommonOtherAlleleIndex(allFreqs, winningAlleleIndex)
 
-        for gen in range(len(freqArray)):
-            freqs = freqArray[gen][snpIndex]
-            winningFreq = freqs[winningAlleleIndex]
-            otherFreq = freqs[otherAlleleIndex]
+    winningFreqs = np.take_along_axis(allFreqs, winningAlleleIndex[:, None, None], axis=2)[:, :, 0]
+    otherFreqs = np.take_along_axis(allFreqs, otherAlleleIndex[:, None, None], axis=2)[:, :, 0]
 
-            freq = winningFreq / (winningFreq + otherFreq)
-            freqArray[gen][snpIndex] = freq
-        # assert winningFreq > 0 and winningFreq >= otherFreq
+    return (winningFreqs / (winningFreqs + otherFreqs)).T
 
 
 # header line copied from README_for_F0-F60SNP_CMH_FET_blockID.sync.docx
 header = """Chromosome	position	base	Dsim_Fl_Base_1	Dsim_Fl_Base_2	Dsim_Fl_Base_3	Dsim_Fl_Base_4	Dsim_Fl_Base_5	Dsim_Fl_Base_6	Dsim_Fl_Base_7	Dsim_Fl_Base_8	Dsim_Fl_Base_9	Dsim_Fl_Base_10	Dsim_Fl_Hot_F10_1	Dsim_Fl_Hot_F10_2	Dsim_Fl_Hot_F10_3	Dsim_Fl_Hot_F10_4	Dsim_Fl_Hot_F10_5	Dsim_Fl_Hot_F10_6	Dsim_Fl_Hot_F10_7	Dsim_Fl_Hot_F10_8	Dsim_Fl_Hot_F10_9	Dsim_Fl_Hot_F10_10	Dsim_Fl_Hot_F20_1	Dsim_Fl_Hot_F20_2	Dsim_Fl_Hot_F20_3	Dsim_Fl_Hot_F20_4	Dsim_Fl_Hot_F20_5	Dsim_Fl_Hot_F20_6	Dsim_Fl_Hot_F20_7	Dsim_Fl_Hot_F20_8	Dsim_Fl_Hot_F20_9	Dsim_Fl_Hot_F20_10	Dsim_Fl_Hot_F30_1	Dsim_Fl_Hot_F30_2	Dsim_Fl_Hot_F30_3	Dsim_Fl_Hot_F30_4	Dsim_Fl_Hot_F30_5	Dsim_Fl_Hot_F30_6	Dsim_Fl_Hot_F30_7	Dsim_Fl_Hot_F30_8	Dsim_Fl_Hot_F30_9	Dsim_Fl_Hot_F30_10	Dsim_Fl_Hot_F40_1	Dsim_Fl_Hot_F40_2	Dsim_Fl_Hot_F40_3	Dsim_Fl_Hot_F40_4	Dsim_Fl_Hot_F40_5	Dsim_Fl_Hot_F40_6	Dsim_Fl_Hot_F40_7	Dsim_Fl_Hot_F40_8	Dsim_Fl_Hot_F40_9	Dsim_Fl_Hot_F40_10	Dsim_Fl_Hot_F50_1	Dsim_Fl_Hot_F50_2	Dsim_Fl_Hot_F50_3	Dsim_Fl_Hot_F50_4	Dsim_Fl_Hot_F50_5	Dsim_Fl_Hot_F50_6	Dsim_Fl_Hot_F50_7	Dsim_Fl_Hot_F50_8	Dsim_Fl_Hot_F50_9	Dsim_Fl_Hot_F50_10	Dsim_Fl_Hot_F60_1	Dsim_Fl_Hot_F60_2	Dsim_Fl_Hot_F60_3	Dsim_Fl_Hot_F60_4	Dsim_Fl_Hot_F60_5	Dsim_Fl_Hot_F60_6	Dsim_Fl_Hot_F60_7	Dsim_Fl_Hot_F60_8	Dsim_Fl_Hot_F60_9	Dsim_Fl_Hot_F60_10	-log10(pvalue)_CMH	-log10(p-value)_FET_rep1	-log10(p-value)_FET_rep2	-log10(p-value)_FET_rep3	-log10(p-value)_FET_rep4	-log10(p-value)_FET_rep5	-log10(p-value)_FET_rep6	-log10(p-value)_FET_rep7	-log10(p-value)_FET_rep8-log10(p-value)_FET_rep9	-log10(p-value)_FET_rep10	blockID_0.75cor	blockID_0.35cor"""
 header = header.strip().split()
 
-freqs = {}
-for i in range(len(header)):
-    if "Dsim" in header[i]:
-        rep, gen = getRepAndGen(header[i])
-        if not rep in freqs:
-            freqs[rep] = {}
-        if not gen in freqs[rep]:
-            freqs[rep][gen] = {}
-
-
-sys.stderr.write("reading snps and freqs\n")
-positions = {}
-with open(inFileName, "rt") as inFile:
-    for line in inFile:
-        line = line.strip().split()
-        chrom = line[0]
-        pos = int(line[1])
-        if chrom == targetChrom:
-            if not chrom in positions:
-                positions[chrom] = []
-                for rep in freqs:
-                    for gen in freqs[rep]:
-                        freqs[rep][gen][chrom] = []
-
-            for i in range(len(line)):
-                if ":" in line[i]:
-                    rep, gen = getRepAndGen(header[i])
-                    currFreqs = getFreqs(line[i])
-                    freqs[rep][gen][chrom].append(currFreqs)
-            positions[chrom].append(pos)
-sys.stderr.write("got all snps and freqs\n")
-
-
-sys.stderr.write("formatting output\n")
-for rep in freqs:
-    for chrom in positions:
+# columns holding base counts, and for each rep the indices of its samples within those columns ordered by gen
+countCols = [i for i in range(len(header)) if "Dsim" in header[i]]
+repSampleIndices = {}
+for sampleIndex, i in enumerate(countCols):
+    rep, gen = getRepAndGen(header[i])
+    if not rep in repSampleIndices:
+        repSampleIndices[rep] = []
+    repSampleIndices[rep].append((gen, sampleIndex))
+for rep in repSampleIndices:
+    repSampleIndices[rep] = [sampleIndex for gen, sampleIndex in sorted(repSampleIndices[rep])]
+reps = sorted(repSampleIndices)
+sampledGens = sorted(set(getRepAndGen(header[i])[1] for i in countCols))
+sampleIndexGrid = np.array([repSampleIndices[rep] for rep in reps])  # (reps, gens)
+
+
+def storeFreqs(freqArray, storage):
+    # returns the freqs in the storage dtype and any extra arrays needed to read them back
+    if storage == "uint8":
+        # nan freqs (no coverage) would otherwise be cast to 0, they get the code above the one for a freq of 1
+        codes = np.rint(freqArray * 254)
+        codes[np.isnan(codes)] = 255
+        return codes.astype(np.uint8), {"freqScale": 1 / 254}
+    return freqArray.astype(storage, copy=False), {}
+
+
+def writeRepInputs(chrom, rep, repIndex, countsShmName, countsShape, countsDtype, chromPositions):
+    # runs in a worker process, the chromosome's counts are read from shared memory instead of being pickled
+    shm = shared_memory.SharedMemory(name=countsShmName)
+    try:
+        chromCounts = np.ndarray(countsShape, dtype=countsDtype, buffer=shm.buf)
         outFileName = f"{outDir}/dsim_chrom_{chrom}_rep_{rep}.npz"
 
-        assert len(positions[chrom]) == len(freqs[rep][gen][chrom])
-
-        freqArray = []
-        for gen in sorted(freqs[rep]):
-            freqArray.append([])
-            for posIndex in range(len(positions[chrom])):
-                currFreqs = freqs[rep][gen][chrom][posIndex]
-                freqArray[-1].append(currFreqs)
-
-        encodeFreqsInPlace(freqArray)
-        freqArray = np.array(freqArray)
-        numGens = len(freqs[rep])
-        assert freqArray.shape == (numGens, len(positions[chrom]))
-
-        allFreqWins = []
-        allPosWins = []
-        startingIndices = range(len(positions[chrom]) - winSize)
-        for i in startingIndices:
-            currWin = freqArray[:, i : i + winSize]
-            allFreqWins.append(currWin)
-            currPositions = positions[chrom][i : i + winSize]
-            allPosWins.append(currPositions)
-        assert i + winSize == len(positions[chrom]) - 1
-
-        allFreqWins = np.array(allFreqWins)
-        allPosWins = np.array(allPosWins)
-        assert allFreqWins.shape == (len(startingIndices), numGens, winSize)
-        assert allPosWins.shape == (len(startingIndices), winSize)
-
-        np.savez(outFileName, aftIn=allFreqWins, aftInPosition=allPosWins)
-sys.stderr.write("all done!\n")
-
+        allFreqs = getFreqs(chromCounts[:, repIndex])  # (snps, gens, 5)
+        del chromCounts
+        freqArray = encodeFreqs(allFreqs, mode=encodingMode)
+        numGens = countsShape[2]
+        assert freqArray.shape == (numGens, len(chromPositions))
+        freqArray, storageInfo = storeFreqs(freqArray, freqStorage)
+
+        if npzFormatVersion == 2:
+            np.savez(
+                outFileName,
+                aftFreqs=freqArray,
+                aftPositions=chromPositions,
+                winSize=winSize,
+                gens=sampledGens,
+                formatVersion=2,
+                **storageInfo,
+            )
+        else:
+            # the final window is left out, as it always has been for these inputs
+            numWins = len(chromPositions) - winSize
+            allFreqWins = sliding_window_view(freqArray, winSize, axis=1)[:, :numWins].transpose(1, 0, 2)
+            allPosWins = sliding_window_view(chromPositions, winSize)[:numWins]
+            assert allFreqWins.shape == (numWins, numGens, winSize)
+            assert allPosWins.shape == (numWins, winSize)
+
+            np.savez(outFileName, aftIn=allFreqWins, aftInPosition=allPosWins, gens=sampledGens, **storageInfo)
+    finally:
+        shm.close()
+
+
+def writeChromInputs(chrom, chromPositions, chromCounts, chromReps):
+    # chromCounts is a (snps, reps, gens, 6) count array, chromReps the rep number of each slice along axis 1
+    sys.stderr.write(f"formatting output for {chrom}\n")
+    assert len(chromPositions) == len(chromCounts)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(chromCounts.nbytes, 1))
+    try:
+        sharedCounts = np.ndarray(chromCounts.shape, dtype=chromCounts.dtype, buffer=shm.buf)
+        sharedCounts[:] = chromCounts
+        del sharedCounts
+
+        chromPositions = np.array(chromPositions)
+        jobs = [
+            (chrom, rep, repIndex, shm.name, chromCounts.shape, chromCounts.dtype, chromPositions)
+            for repIndex, rep in enumerate(chromReps)
+        ]
+        with mp.Pool(processes=min(numWorkers, len(jobs))) as pool:
+            pool.starmap(writeRepInputs, jobs)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def convertFromCache():
+    sys.stderr.write(f"reading snps and counts from {syncCacheDir}\n")
+    cache = loadSyncCache(syncCacheDir)
+    assert list(cache["gens"]) == sampledGens
+    for chrom in cache["chromNames"]:
+        if targetChroms and not chrom in targetChroms:
+            continue
+        snpIndices = getChromSnpIndices(cache, chrom)
+        chromSlice = slice(snpIndices[0], snpIndices[-1] + 1)  # chromosomes are contiguous in the sync file
+        writeChromInputs(chrom, cache["positions"][chromSlice], cache["counts"][chromSlice], list(cache["reps"]))
+
+
+def convertFromSync():
+    # the sync file is sorted by chromosome, so each chromosome is written out as soon as
+    # its block ends and only one chromosome's counts are held in memory at a time
+    sys.stderr.write("reading snps and freqs\n")
+    doneChroms = set()
+    currChrom, chromPositions, chromCounts = None, [], None
+    with open(inFileName, "rt") as inFile:
+        for line in inFile:
+            line = line.strip().split()
+            chrom = line[0]
+            pos = int(line[1])
+            if targetChroms and not chrom in targetChroms:
+                continue
+
+            if chrom != currChrom:
+                if currChrom is not None:
+                    writeChromInputs(currChrom, chromPositions, np.array(chromCounts)[:, sampleIndexGrid], reps)
+                    doneChroms.add(currChrom)
+                assert not chrom in doneChroms, f"{chrom} is not contiguous in {inFileName}"
+                currChrom, chromPositions, chromCounts = chrom, [], []
+
+            chromCounts.append(getCounts([line[i] for i in countCols]))
+            chromPositions.append(pos)
+
+    if currChrom is not None:
+        writeChromInputs(currChrom, chromPositions, np.array(chromCounts)[:, sampleIndexGrid], reps)
+
+
+if __name__ == "__main__":
+    if syncCacheDir is not None:
+        convertFromCache()
+    else:
+        convertFromSync()
+    sys.stderr.write("all done!\n")
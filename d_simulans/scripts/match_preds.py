@@ -3,59 +3,55 @@ from glob import glob
 from tqdm import tqdm
 import numpy as np
 import matplotlib.pyplot as plt
+import os
 import random
+import sys
 
-"""
-header = "Chromosome    position    -log10(p-value)_FET_rep1    -log10(p-value)_FET_rep2    -log10(p-value)_FET_rep3    -log10(p-value)_FET_rep4    -log10(p-value)_FET_rep5    -log10(p-value)_FET_rep6    -log10(p-value)_FET_rep7    -log10(p-value)_FET_rep8  -log10(p-value)_FET_rep9    -log10(p-value)_FET_rep10"
-
-dict_list = []
-with open("/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/pvals.tsv", 'r') as ifile:
-    for line in tqdm(ifile.readlines()):
-        line = line.strip().split()
-        for rep in range(1, 11):
-            line_dict = {}
-            line_dict["Chrom"] = line[0]
-            line_dict["BP"] = line[1]
-            line_dict["rep"] = rep
-            line_dict["fet"] = line[1 + rep]
-            dict_list.append(line_dict)
-#exp_pvals = pd.DataFrame.from_records(dict_list)
-exp_pvals.to_csv("fet_all.tsv", sep="\t")
-#exp_pvals = pd.read_csv("fet_all.tsv", sep="\t")
-
-nn_list = []
-
-for rep in tqdm(range(1, 11)):
-    aft_ifiles = glob(
-        f"/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/timesweeper_output/unif_velocity_0_thresh/aft_*_{rep}_preds.csv"
-    )
-    for aft_file in aft_ifiles:
-        df = pd.read_csv(aft_file, header=0, sep="\t")
-        df["rep"] = [int(rep)] * len(df)
-        nn_list.append(df)
+from pred_comparison import bin_summary, merge_preds_fet, read_merged
+from sync_cache import loadSyncCache
+
+syncCacheDir = "/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/sync_cache"
+remerge = False  # rebuild all_merged.tsv from the sync cache and the Timesweeper predictions
+pred_ext = "csv"  # "parquet" reads the typed predictions written by find_sweeps_npz.py --parquet
 
-aft_df = pd.concat(nn_list)
+if remerge:
+    if pred_ext == "parquet":
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "workflow"))
+        from pred_table import read_preds
+
+    # one row per (snp, rep) with that rep's FET -log10(p-value), nan where the sync file has na
+    cache = loadSyncCache(syncCacheDir)
+    cache_reps = np.array(cache["reps"])
+    exp_pvals = pd.DataFrame(
+        {
+            "Chrom": np.array(cache["chromNames"])[cache["chroms"]].repeat(len(cache_reps)),
+            "BP": np.repeat(cache["positions"], len(cache_reps)),
+            "rep": np.tile(cache_reps, len(cache["positions"])),
+            "fet": cache["pvals"][:, 1:].ravel(),  # column 0 is the CMH test
+        }
+    )
 
-aft_df = aft_df.astype(str)
-exp_pvals = exp_pvals.astype(str)
+    nn_list = []
 
-all_merged = aft_df.merge(
-    exp_pvals, left_on=["Chrom", "BP", "rep"], right_on=["Chrom", "BP", "rep"]
-)
+    for rep in tqdm(range(1, 11)):
+        aft_ifiles = glob(
+            f"/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/timesweeper_output/unif_velocity_0_thresh/aft_*_{rep}_preds.{pred_ext}"
+        )
+        for aft_file in aft_ifiles:
+            if pred_ext == "parquet":
+                df = read_preds(aft_file)
+            else:
+                df = pd.read_csv(aft_file, header=0, sep="\t")
+            df["rep"] = [int(rep)] * len(df)
+            nn_list.append(df)
 
-all_merged.to_csv("all_merged.tsv", sep="\t", header=True, index=False)
-"""
+    aft_df = pd.concat(nn_list)
 
-all_merged = pd.read_csv(
-    "/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/results/all_merged.tsv",
-    sep="\t",
-)
+    all_merged = merge_preds_fet(aft_df, exp_pvals)
 
-all_merged = all_merged.replace("na", np.NaN)
-all_merged = all_merged.dropna()
+    all_merged.to_csv("all_merged.tsv", sep="\t", header=True, index=False)
 
-all_merged["fet"] = all_merged["fet"].astype(float)
-all_merged["Soft_Score"] = all_merged["Soft_Score"].astype(float)
+all_merged = read_merged("/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/results/all_merged.tsv")
 
 print("Calculating correlation")
 corr = all_merged[["fet", "Soft_Score"]].corr("spearman")
@@ -77,52 +73,13 @@ if plot:
 
 
 print("Bin-wise summary")
-bins = list(np.around(np.arange(0, 1.05, 0.05), 2))
+bins = np.around(np.arange(0, 1.05, 0.05), 2).tolist()
 bins.insert(-1, 0.99)
 
-ts_res_bins = []
-for i in tqdm(range(len(bins) - 1), desc="Summing over bins"):
-    _df = all_merged[
-        (all_merged["Soft_Score"] > bins[i]) & (all_merged["Soft_Score"] <= bins[i + 1])
-    ]
-    sp = _df["fet"].corr(_df["Soft_Score"], "spearman")
-
-    ts_res_bins.append(
-        {
-            "bin": (bins[i], bins[i + 1]),
-            "num_calls": len(_df),
-            "spearman": sp,
-            "max_fet": _df["fet"].max(),
-            "min_fet": _df["fet"].min(),
-            "mean_fet": _df["fet"].mean(),
-            "med_fet": _df["fet"].median(),
-            "variance": _df["fet"].var(),
-            "std": _df["fet"].std(),
-        }
-    )
-
-ts_res_df = pd.DataFrame(ts_res_bins)
+ts_res_df = bin_summary(all_merged, "Soft_Score", "fet", bins)
 ts_res_df.to_csv("fet_by_ts.tsv", sep="\t", index=False, float_format="%.3f")
 
-bins = list(np.arange(0, 121, 5))
+bins = np.arange(0, 121, 5).tolist()
 print(bins)
-fet_res_bins = []
-for i in range(len(bins) - 1):
-    _df = all_merged[(all_merged["fet"] > bins[i]) & (all_merged["fet"] <= bins[i + 1])]
-    sp = _df["fet"].corr(_df["Soft_Score"], "spearman")
-    fet_res_bins.append(
-        {
-            "bin": (bins[i], bins[i + 1]),
-            "num_calls": len(_df),
-            "spearman": sp,
-            "max_Soft_Score": _df["Soft_Score"].max(),
-            "min_Soft_Score": _df["Soft_Score"].min(),
-            "mean_Soft_Score": _df["Soft_Score"].mean(),
-            "med_Soft_Score": _df["Soft_Score"].median(),
-            "variance": _df["Soft_Score"].var(),
-            "std": _df["Soft_Score"].std(),
-        }
-    )
-
-fet_res_df = pd.DataFrame(fet_res_bins)
+fet_res_df = bin_summary(all_merged, "fet", "Soft_Score", bins)
 fet_res_df.to_csv("ts_by_fet.tsv", sep="\t", index=False, float_format="%.3f")
@@ -0,0 +1,101 @@
+"""
+Typed merge of Timesweeper predictions with the E&R FET scores, and bin-wise summaries of one score against the other,
+used by match_preds.py.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+merge_keys = ["Chrom", "BP", "rep"]
+
+
+def type_keys(df, chroms):
+    """
+    Casts the merge keys to compact types: Chrom to a categorical over chroms, BP to int64 and rep to int16.
+
+    Args:
+        df (pd.DataFrame): Table with Chrom, BP and rep columns.
+        chroms (list[str]): Categories for Chrom, shared by both sides of a merge so the codes line up.
+
+    Returns:
+        pd.DataFrame: df with typed keys.
+    """
+    return df.assign(
+        Chrom=pd.Categorical(df["Chrom"].astype(str), categories=chroms),
+        BP=df["BP"].astype(np.int64),
+        rep=df["rep"].astype(np.int16),
+    )
+
+
+def merge_preds_fet(preds_df, fet_df):
+    """
+    Merges predictions with FET scores on typed Chrom/BP/rep keys, dropping rows where anything is missing.
+
+    Args:
+        preds_df (pd.DataFrame): Predictions of find_sweeps_npz.py with a rep column added.
+        fet_df (pd.DataFrame): Chrom, BP, rep and fet columns, fet nan where the sync file has na.
+
+    Returns:
+        pd.DataFrame: Merged rows with numeric scores.
+    """
+    chroms = sorted(set(preds_df["Chrom"].astype(str).unique()) | set(fet_df["Chrom"].astype(str).unique()))
+    merged = type_keys(preds_df, chroms).merge(type_keys(fet_df, chroms), on=merge_keys)
+
+    return merged.dropna()
+
+
+def read_merged(merged_file):
+    """Reads a merged table written by match_preds.py with typed keys, "na" read as missing and dropped."""
+    merged = pd.read_csv(merged_file, sep="\t", na_values=["na"], dtype={"Chrom": "category"})
+    merged = merged.dropna()
+
+    return type_keys(merged, list(merged["Chrom"].cat.categories))
+
+
+def bin_summary(df, bin_col, value_col, bins):
+    """
+    Summarizes value_col within bins of bin_col, including the Spearman correlation between the two in each bin.
+
+    Bins are (bins[i], bins[i+1]] intervals. Everything is computed in one groupby pass, Spearman correlations
+    as the Pearson correlation of within-bin average ranks.
+
+    Args:
+        df (pd.DataFrame): Table with numeric bin_col and value_col columns.
+        bin_col (str): Column to bin on.
+        value_col (str): Column to summarize.
+        bins (list[float]): Bin edges.
+
+    Returns:
+        pd.DataFrame: One row per bin, empty bins included.
+    """
+    binned = pd.DataFrame({"bin": pd.cut(df[bin_col], bins, labels=False), "x": df[bin_col], "y": df[value_col]})
+    binned = binned.dropna(subset=["bin"]).astype({"bin": int})
+    grouped = binned.groupby("bin")
+
+    # spearman: pearson correlation of the ranks within each bin
+    ranks = grouped[["x", "y"]].rank()
+    centered = ranks - ranks.groupby(binned["bin"]).transform("mean")
+    rank_sums = pd.DataFrame(
+        {"xy": centered["x"] * centered["y"], "xx": centered["x"] ** 2, "yy": centered["y"] ** 2}
+    ).groupby(binned["bin"]).sum()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        spearman = rank_sums["xy"] / np.sqrt(rank_sums["xx"] * rank_sums["yy"])
+
+    stats = grouped["y"].agg(["size", "max", "min", "mean", "median", "var", "std"])
+    summary = pd.DataFrame(
+        {
+            "num_calls": stats["size"],
+            "spearman": spearman,
+            f"max_{value_col}": stats["max"],
+            f"min_{value_col}": stats["min"],
+            f"mean_{value_col}": stats["mean"],
+            f"med_{value_col}": stats["median"],
+            "variance": stats["var"],
+            "std": stats["std"],
+        }
+    ).reindex(range(len(bins) - 1))
+    summary["num_calls"] = summary["num_calls"].fillna(0).astype(int)
+    summary.insert(0, "bin", [(bins[i], bins[i + 1]) for i in range(len(bins) - 1)])
+
+    return summary.reset_index(drop=True)
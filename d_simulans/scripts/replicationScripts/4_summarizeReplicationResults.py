@@ -1,50 +1,94 @@
+import os
 import sys
 import glob
+import json
 import numpy as np
+import pandas as pd
 
-runMode, percentileThresh, printLines, tsOrFet = sys.argv[1:]
+#usage: python 4_summarizeReplicationResults.py <runMode(s)> <percentileThresh(es)> <printLines> <ts|FET|both>
+#runModes and percentiles can be comma-separated to evaluate every combination in one run, e.g. unif_vel_0_thresh,unif_last_0_thresh 0.9,0.95,0.99 False both
+runModeArg, percentileArg, printLines, tsOrFetArg = sys.argv[1:]
 
-assert tsOrFet in ["ts","FET"]
-percentileThresh = float(percentileThresh)
+assert tsOrFetArg in ["ts","FET","both"]
+runModes = runModeArg.split(",")
+percentileThreshes = [float(x) for x in percentileArg.split(",")]
 printLines = bool(printLines == "True")
+tsOrFets = ["ts","FET"] if tsOrFetArg == "both" else [tsOrFetArg]
 
-allScoreCompFileNames = glob.glob(f"/pine/scr/d/s/dschride/data/timeSeriesSweeps/compareToFETOut/rep*ScoreComp*_{runMode}.txt")
+scoreDistDir = "/pine/scr/d/s/dschride/data/timeSeriesSweeps/scoreDists" #sorted scores of each runMode are cached here, set to None to always re-read the comparison files
 
-scoreIndex = 2 if tsOrFet == "ts" else 3
+def getScoreDist(runMode):
+    #sorted ts and FET scores of every comparison file of the runMode, reused from scoreDistDir while the files are unchanged
+    allScoreCompFileNames = sorted(glob.glob(f"/pine/scr/d/s/dschride/data/timeSeriesSweeps/compareToFETOut/rep*ScoreComp*_{runMode}.txt"))
+    fileStamps = json.dumps([(cfn, os.path.getsize(cfn), os.path.getmtime(cfn)) for cfn in allScoreCompFileNames])
+    cacheFileName = None if scoreDistDir is None else os.path.join(scoreDistDir, f"{runMode}_scoreDist.npz")
+    if cacheFileName is not None and os.path.exists(cacheFileName):
+        scoreDist = np.load(cacheFileName)
+        if str(scoreDist['fileStamps']) == fileStamps:
+            sys.stderr.write(f'using cached scores for {runMode} from {cacheFileName}\n')
+            return {'ts': scoreDist['ts'], 'FET': scoreDist['FET']}
 
-scores = []
-for cfn in allScoreCompFileNames:
-    #sys.stderr.write(f'reading {cfn}\n')
-    with open(cfn, 'rt') as cf:
-        for line in cf:
-            scores.append(float(line.strip().split()[scoreIndex]))
-threshold = np.percentile(scores, percentileThresh*100)
-sys.stderr.write(f'chosen threshold for {runMode}: ({percentileThresh*100}th percentile): {threshold}\n')
+    tsScores, fetScores = [], []
+    for cfn in allScoreCompFileNames:
+        #sys.stderr.write(f'reading {cfn}\n')
+        #round_trip parsing gives the same floats as float()
+        scoreDf = pd.read_csv(cfn, sep=r"\s+", header=None, usecols=[2, 3], float_precision="round_trip")
+        tsScores.append(scoreDf[2].to_numpy(dtype=np.float64))
+        fetScores.append(scoreDf[3].to_numpy(dtype=np.float64))
+    scoreDist = {'ts': np.sort(np.concatenate(tsScores)), 'FET': np.sort(np.concatenate(fetScores))}
 
-for rep in range(1, 11):
-    outLines = []
-    expectation, observation = 0, 0
-    sys.stderr.write(f'processing rep {rep}\n')
-    fn = f"/pine/scr/d/s/dschride/data/timeSeriesSweeps/replicationOfTopHits{'' if tsOrFet == 'ts' else 'FET'}/rep{rep}_{runMode}_repComp.txt"
+    if cacheFileName is not None:
+        os.makedirs(scoreDistDir, exist_ok=True)
+        np.savez(cacheFileName, fileStamps=fileStamps, **scoreDist)
+    return scoreDist
+
+def readRepComp(fn, tsOrFet):
+    #lines of a repComp file made by 2_checkReplication.py or 3_checkReplicationFET.py, with the other reps' scores of each line
+    repLines = []
     with open(fn, 'rt') as f:
         for line in f:
             line = line.strip()
             splitLine = line.split("\t")
             chrom, pos, tsScore, fetScore, freqVel, otherTsScoreStr, otherFetScoreStr, otherFreqVelsStr = splitLine
             pos = int(pos)
-            if tsOrFet == "ts":
-                otherScores = [float(x) for x in otherTsScoreStr.split("|")]
-            else:
-                otherScores = [float(x) for x in otherFetScoreStr.split("|")]
-            #expectation += 1 - (percentileThresh**len(otherScores))
-            expectation += (1-percentileThresh)*len(otherScores)
-            replicationVector = [1 if x > threshold else 0 for x in otherScores]
-            observation += sum(replicationVector)
-            outLines.append((chrom, pos, len(otherScores), replicationVector, line))
-
-    outLines.sort()
-    sys.stderr.write(f"observed: {observation}, expected: {expectation}\n")
-
-    if printLines:
-        for chrom, pos, otherScoreLen, replicationVector, line in outLines:
-            print(str(rep) + "\t" + str(otherScoreLen) + "\t" + "|".join([str(x) for x in replicationVector])  + "\t" + line)
+            otherScoreStr = otherTsScoreStr if tsOrFet == "ts" else otherFetScoreStr
+            otherScores = np.array([float(x) for x in otherScoreStr.split("|") if x], dtype=np.float64)
+            repLines.append((chrom, pos, otherScores, line))
+    return repLines
+
+summary = []
+for runMode in runModes:
+    scoreDist = getScoreDist(runMode)
+    for tsOrFet in tsOrFets:
+        thresholds = np.percentile(scoreDist[tsOrFet], [p*100 for p in percentileThreshes])
+        for percentileThresh, threshold in zip(percentileThreshes, thresholds):
+            sys.stderr.write(f'chosen threshold for {runMode}: ({percentileThresh*100}th percentile): {threshold}\n')
+
+        observations, expectations = np.zeros(len(percentileThreshes), dtype=np.int64), np.zeros(len(percentileThreshes))
+        for rep in range(1, 11):
+            sys.stderr.write(f'processing rep {rep}\n')
+            fn = f"/pine/scr/d/s/dschride/data/timeSeriesSweeps/replicationOfTopHits{'' if tsOrFet == 'ts' else 'FET'}/rep{rep}_{runMode}_repComp.txt"
+            repLines = readRepComp(fn, tsOrFet)
+            allOtherScores = np.concatenate([otherScores for chrom, pos, otherScores, line in repLines] + [np.empty(0)])
+
+            for i, (percentileThresh, threshold) in enumerate(zip(percentileThreshes, thresholds)):
+                #expectation += 1 - (percentileThresh**len(otherScores))
+                expectation = sum([(1-percentileThresh)*len(otherScores) for chrom, pos, otherScores, line in repLines])
+                observation = int((allOtherScores > threshold).sum())
+                observations[i] += observation
+                expectations[i] += expectation
+                sys.stderr.write(f"observed: {observation}, expected: {expectation}\n")
+
+                if printLines:
+                    if len(runModes) * len(tsOrFets) * len(percentileThreshes) > 1:
+                        print(f"#{runMode}\t{tsOrFet}\t{percentileThresh}")
+                    for chrom, pos, otherScores, line in sorted(repLines, key=lambda x: (x[0], x[1])):
+                        replicationVector = (otherScores > threshold).astype(int).tolist()
+                        print(str(rep) + "\t" + str(len(otherScores)) + "\t" + "|".join([str(x) for x in replicationVector])  + "\t" + line)
+
+        for percentileThresh, threshold, observation, expectation in zip(percentileThreshes, thresholds, observations, expectations):
+            summary.append((runMode, tsOrFet, percentileThresh, threshold, observation, expectation))
+
+sys.stderr.write("runMode\tscore\tpercentile\tthreshold\tobserved\texpected\tobserved/expected\n")
+for runMode, tsOrFet, percentileThresh, threshold, observation, expectation in summary:
+    sys.stderr.write(f"{runMode}\t{tsOrFet}\t{percentileThresh}\t{threshold}\t{observation}\t{expectation}\t{observation/expectation if expectation else np.nan}\n")
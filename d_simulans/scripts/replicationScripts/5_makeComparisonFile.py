@@ -1,75 +1,130 @@
+import os
 import sys
 import numpy as np
 import scipy.stats
 from sklearn import metrics
 import matplotlib.pyplot as plt
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sync_cache import getChromSnpIndices, loadPvalTable, loadSyncCache
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workflow"))
+
 
 origCallFileName = "/proj/dschridelab/drosophila/simulansEAndR/Dsim_F0-F60_Q20_polymorphic_CMH_FET_blockID.sync"
+syncCacheDir = None #if set, FET scores are read from this cache made by sync_cache.py instead of origCallFileName
+pvalTableDir = None #if set, FET scores of targetChrom alone are read from this table made by sync_cache.py (<cache dir>/pvalTable or --pvals-only), taking precedence over syncCacheDir
 tsCallDir = f"/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/timesweeper_output"
 
 tsCallFileName, rep, targetChrom, inputFileName, compFileName = sys.argv[1:]
 rep = int(rep)
 
-def runComps(tsCallFileName, inputFileName, compFileName):
+def loadCenterFreqsAndPositions(inputFileName):
     inputs = np.load(inputFileName)
-    freqs = inputs['aftIn'][:,:,25]
-    positions = inputs['aftInPosition'][:,25]
+    if 'aftFreqs' in inputs:
+        #format version 2: (gens, snps) freqs that have not been split into windows; the final window is left out
+        winSize = int(inputs['winSize'])
+        numWins = max(len(inputs['aftPositions']) - winSize, 0)
+        center = winSize // 2
+        freqs = inputs['aftFreqs'][:, center:center+numWins].T
+        positions = inputs['aftPositions'][center:center+numWins]
+    else:
+        freqs = inputs['aftIn'][:,:,25]
+        positions = inputs['aftInPosition'][:,25]
+    if 'freqScale' in inputs:
+        #freqs were stored quantized to uint8, codes above the one for a freq of 1 mark missing freqs
+        freqScale = float(inputs['freqScale'])
+        freqs = np.where(freqs > round(1/freqScale), np.nan, freqs * freqScale)
+    return freqs, positions
+
+def lastByPosition(positions, values):
+    #sorts by position, keeping the last value given for a position just like the dicts this replaced did
+    order = np.argsort(positions, kind='stable')
+    positions, values = np.asarray(positions)[order], np.asarray(values)[order]
+    isLast = np.ones(len(positions), dtype=bool)
+    isLast[:-1] = positions[1:] != positions[:-1]
+    return positions[isLast], values[isLast]
+
+def lookup(sortedPositions, values, queryPositions):
+    #values at each query position (in query order) and whether the position was found at all
+    if len(sortedPositions) == 0:
+        return np.zeros(len(queryPositions), dtype=bool), np.full((len(queryPositions),) + values.shape[1:], np.nan)
+    indices = np.searchsorted(sortedPositions, queryPositions).clip(max=len(sortedPositions) - 1)
+    return sortedPositions[indices] == queryPositions, values[indices]
+
+def runComps(tsCallFileName, inputFileName, compFileName):
+    freqs, positions = loadCenterFreqsAndPositions(inputFileName)
     assert len(freqs) == len(positions)
 
 
-    tsScores = {}
     first = True
     try:
-        with open(tsCallFileName, 'rt') as tsf:
-            for line in tsf:
-                if first:
-                    first = False
-                else:
-                    chrom, pos, classPred, neutProb, softProb, winS, winE = line.strip().split("\t")
-                    pos = int(pos)
-                    tsScores[(chrom, pos)] = float(softProb)
+        if tsCallFileName.endswith(".parquet"):
+            from pred_table import read_preds
+            tsCalls = read_preds(tsCallFileName, chroms=[targetChrom], columns=["Chrom", "BP", "Soft_Score"])
+            tsPositions = tsCalls["BP"].to_numpy(dtype=np.int64)
+            #rounded to the same 3 decimals as the text output so that both give identical comparison files
+            tsScores = np.round(tsCalls["Soft_Score"].to_numpy(dtype=np.float64), 3)
+        else:
+            tsPositions, tsScores = [], []
+            with open(tsCallFileName, 'rt') as tsf:
+                for line in tsf:
+                    if first:
+                        first = False
+                    else:
+                        chrom, pos, classPred, neutProb, softProb, winS, winE = line.strip().split("\t")
+                        if chrom == targetChrom:
+                            tsPositions.append(int(pos))
+                            tsScores.append(float(softProb))
+            tsPositions, tsScores = np.array(tsPositions, dtype=np.int64), np.array(tsScores, dtype=np.float64)
     except Exception as err:
         print('Error reading tsCallFile:', err)
         return
+    tsPositions, tsScores = lastByPosition(tsPositions, tsScores)
 
 
     header = """Chromosome  position        base    Dsim_Fl_Base_1  Dsim_Fl_Base_2  Dsim_Fl_Base_3  Dsim_Fl_Base_4  Dsim_Fl_Base_5  Dsim_Fl_Base_6  Dsim_Fl_Base_7  Dsim_Fl_Base_8  Dsim_Fl_Base_9  Dsim_Fl_Base_10 Dsim_Fl_Hot_F10_1       Dsim_Fl_Hot_F10_2       Dsim_Fl_Hot_F10_3       Dsim_Fl_Hot_F10_4       Dsim_Fl_Hot_F10_5       Dsim_Fl_Hot_F10_6       Dsim_Fl_Hot_F10_7       Dsim_Fl_Hot_F10_8       Dsim_Fl_Hot_F10_9       Dsim_Fl_Hot_F10_10      Dsim_Fl_Hot_F20_1       Dsim_Fl_Hot_F20_2       Dsim_Fl_Hot_F20_3       Dsim_Fl_Hot_F20_4       Dsim_Fl_Hot_F20_5       Dsim_Fl_Hot_F20_6       Dsim_Fl_Hot_F20_7       Dsim_Fl_Hot_F20_8       Dsim_Fl_Hot_F20_9       Dsim_Fl_Hot_F20_10      Dsim_Fl_Hot_F30_1       Dsim_Fl_Hot_F30_2       Dsim_Fl_Hot_F30_3       Dsim_Fl_Hot_F30_4       Dsim_Fl_Hot_F30_5       Dsim_Fl_Hot_F30_6       Dsim_Fl_Hot_F30_7       Dsim_Fl_Hot_F30_8       Dsim_Fl_Hot_F30_9       Dsim_Fl_Hot_F30_10      Dsim_Fl_Hot_F40_1       Dsim_Fl_Hot_F40_2       Dsim_Fl_Hot_F40_3       Dsim_Fl_Hot_F40_4       Dsim_Fl_Hot_F40_5       Dsim_Fl_Hot_F40_6       Dsim_Fl_Hot_F40_7       Dsim_Fl_Hot_F40_8       Dsim_Fl_Hot_F40_9       Dsim_Fl_Hot_F40_10      Dsim_Fl_Hot_F50_1       Dsim_Fl_Hot_F50_2       Dsim_Fl_Hot_F50_3       Dsim_Fl_Hot_F50_4       Dsim_Fl_Hot_F50_5       Dsim_Fl_Hot_F50_6       Dsim_Fl_Hot_F50_7       Dsim_Fl_Hot_F50_8       Dsim_Fl_Hot_F50_9       Dsim_Fl_Hot_F50_10      Dsim_Fl_Hot_F60_1       Dsim_Fl_Hot_F60_2       Dsim_Fl_Hot_F60_3       Dsim_Fl_Hot_F60_4       Dsim_Fl_Hot_F60_5       Dsim_Fl_Hot_F60_6       Dsim_Fl_Hot_F60_7       Dsim_Fl_Hot_F60_8       Dsim_Fl_Hot_F60_9       Dsim_Fl_Hot_F60_10      -log10(pvalue)_CMH      -log10(p-value)_FET_rep1        -log10(p-value)_FET_rep2        -log10(p-value)_FET_rep3        -log10(p-value)_FET_rep4        -log10(p-value)_FET_rep5        -log10(p-value)_FET_rep6        -log10(p-value)_FET_rep7        -log10(p-value)_FET_rep8        -log10(p-value)_FET_rep9        -log10(p-value)_FET_rep10       blockID_0.75cor blockID_0.35cor""".split()
 
-    focalRepTestIndex = header.index(f"-log10(p-value)_FET_rep{rep}")
-    otherRepTestIndices = [header.index(f"-log10(p-value)_FET_rep{x}") for x in range(1, 11) if x != rep]
+    #missing test values are nan, the FET of the focal rep is column 0 followed by those of the other reps
+    if pvalTableDir is not None or syncCacheDir is not None:
+        if pvalTableDir is not None:
+            chromPositions, chromPvals = loadPvalTable(pvalTableDir, targetChrom)
+            cacheReps = list(np.load(os.path.join(pvalTableDir, 'reps.npy')))
+        else:
+            cache = loadSyncCache(syncCacheDir)
+            snpIndices = getChromSnpIndices(cache, targetChrom)
+            chromPositions, chromPvals = cache['positions'][snpIndices], cache['pvals'][snpIndices]
+            cacheReps = list(cache['reps'])
+        #pvals column 0 is the CMH test, followed by the FET of each rep
+        focalRepTestIndex = 1 + cacheReps.index(rep)
+        otherRepTestIndices = [1 + i for i in range(len(cacheReps)) if cacheReps[i] != rep]
+        fetPositions, fetScores = lastByPosition(chromPositions, chromPvals[:, [focalRepTestIndex] + otherRepTestIndices])
+    else:
+        focalRepTestIndex = header.index(f"-log10(p-value)_FET_rep{rep}")
+        otherRepTestIndices = [header.index(f"-log10(p-value)_FET_rep{x}") for x in range(1, 11) if x != rep]
 
-    ogScores = {}
-    otherScores = {}
-    with open(origCallFileName, 'rt') as of:
-        for line in of:
-            line = line.strip().split("\t")
-            chrom, pos = line[0], line[1]
-            pos = int(pos)
+        fetPositions, fetScores = [], []
+        with open(origCallFileName, 'rt') as of:
+            for line in of:
+                #only lines of targetChrom are split
+                if line.startswith(targetChrom + "\t"):
+                    line = line.strip().split("\t")
+                    fetPositions.append(int(line[1]))
+                    fetScores.append([float(line[x]) if line[x] != "na" else np.nan for x in [focalRepTestIndex] + otherRepTestIndices])
+        fetScores = np.array(fetScores, dtype=np.float64).reshape(-1, 1 + len(otherRepTestIndices))
+        fetPositions, fetScores = lastByPosition(np.array(fetPositions, dtype=np.int64), fetScores)
 
-            #Note: setting missing test values to -1, which works because these are -log10(p-value) so they should never be negative
-            ogScores[(chrom, pos)] = float(line[focalRepTestIndex]) if line[focalRepTestIndex] != "na" else -1
-            otherScores[(chrom, pos)] = [float(line[x]) if line[x] != "na" else -1 for x in otherRepTestIndices]
 
+    tsFound, posTsScores = lookup(tsPositions, tsScores, positions)
+    fetFound, posFetScores = lookup(fetPositions, fetScores, positions)
+    ogScores = posFetScores[:, 0]
+    #nan only when every other rep is missing
+    maxOther = np.fmax.reduce(posFetScores[:, 1:], axis=1)
+    keep = tsFound & fetFound & ~np.isnan(ogScores) & ~np.isnan(maxOther)
 
-    y = []
-    tsY, ogY = [], []
+    rowFormat = "%s\t%d\t%s\t%s\t%s" + "\t%.4f" * freqs.shape[1] + "\n"
+    rows = zip(positions[keep].tolist(), posTsScores[keep].tolist(), ogScores[keep].tolist(), maxOther[keep].tolist(), np.asarray(freqs)[keep].tolist())
     with open(compFileName, 'wt') as compF:
-        for i in range(len(positions)):
-            loc = (targetChrom, positions[i])
-            if loc in tsScores and loc in ogScores and loc in otherScores:
-                #print(loc, tsScores[loc], ogScores[loc], otherScores[loc])
-                maxOther = max(otherScores[loc])
-                if ogScores[loc] != -1 and maxOther != -1:
-                    freqStr =  "\t".join([f'{x:.4f}' for x in freqs[i]])
-                    outLine = "\t".join([str(x) for x in [loc[0], loc[1], tsScores[loc], ogScores[loc], maxOther]]) + "\t" + freqStr
-                    compF.write(outLine + "\n")
-                    if maxOther >= 30:
-                        y.append(1)
-                    else:
-                        y.append(0)
-                    tsY.append(tsScores[loc])
-                    ogY.append(ogScores[loc])
+        compF.write("".join([rowFormat % ((targetChrom, pos, tsScore, ogScore, maxOtherScore) + tuple(posFreqs)) for pos, tsScore, ogScore, maxOtherScore, posFreqs in rows]))
 
 
 runComps(tsCallFileName, inputFileName, compFileName)
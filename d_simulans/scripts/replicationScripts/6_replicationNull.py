@@ -0,0 +1,38 @@
+import sys
+import numpy as np
+from rep_matrix import buildRepMatrix, getTopHits, permutationNull
+
+#usage: python 6_replicationNull.py <runMode> <percentileThresh> <ts|FET> <circular|freq|coverage> <numPerms>
+#empirical null for the replication counts of 4_summarizeReplicationResults.py: the top hits of each rep are picked as in
+#2_checkReplication.py / 3_checkReplicationFET.py and their replication in the other reps is compared with random position sets
+runMode, percentileThresh, tsOrFet, method, numPerms = sys.argv[1:]
+
+assert tsOrFet in ["ts","FET"]
+assert method in ["circular","freq","coverage"]
+percentileThresh = float(percentileThresh)
+numPerms = int(numPerms)
+
+reps = range(1, 11)
+targetChroms = "2L 2R 3L 3R X".split()
+scoreName = "ts" if tsOrFet == "ts" else "fet"
+hitThreshold = 0.9 if tsOrFet == "ts" else 10.0 #as in 2_checkReplication.py and 3_checkReplicationFET.py
+top = 100
+seed = 42
+
+compFileNames = {(rep, targetChrom): f"/pine/scr/d/s/dschride/data/timeSeriesSweeps/compareToFETOut/rep{rep}ScoreComp{targetChrom}_{runMode}.txt" for rep in reps for targetChrom in targetChroms}
+repMatrix = buildRepMatrix(compFileNames, targetChroms, list(reps))
+
+#same threshold as 4_summarizeReplicationResults.py, every score in the runMode's comparison files
+threshold = np.percentile(repMatrix[scoreName][repMatrix["present"]], percentileThresh*100)
+sys.stderr.write(f'chosen threshold for {runMode}: ({percentileThresh*100}th percentile): {threshold}\n')
+
+print("rep\tnumHits\tobserved\tanalyticExpected\tnullMean\tnull2.5\tnull97.5\tp")
+for rep in reps:
+    sys.stderr.write(f'processing rep {rep}\n')
+    hitRows = getTopHits(repMatrix, rep, scoreName, [hitThreshold], [top])[(hitThreshold, top)]
+    if len(hitRows) == 0:
+        continue
+    null = permutationNull(repMatrix, rep, hitRows, scoreName, threshold, method, numPerms=numPerms, seed=seed + rep)
+    analyticExpected = (1-percentileThresh)*null["observedPresent"]
+    nullLow, nullHigh = np.percentile(null["nullCounts"], [2.5, 97.5])
+    print(f"{rep}\t{len(hitRows)}\t{null['observed']}\t{analyticExpected}\t{null['nullCounts'].mean()}\t{nullLow}\t{nullHigh}\t{null['pValue']}")
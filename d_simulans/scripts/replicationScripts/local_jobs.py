@@ -0,0 +1,166 @@
+"""
+Runs the commands the replication scripts would submit as SLURM jobs through runCmdAsJob on the local machine instead.
+
+runCmdAsJobWithoutWaitingWithLog takes the same arguments as its runCmdAsJob counterpart, so a script only has to
+import this module in its place. Commands run as local processes, each with its output streamed to its log file. As
+many run at once as fit in the memory budget (the sum of their mem requests) and the cpu count. A task whose wall
+time runs out is killed, as SLURM would. waitForJobs blocks until every task is done and reports the runtime of
+each, it is also called at exit so that no submitted task is left behind.
+"""
+
+import atexit
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+memUnits = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30, "T": 1 << 40}
+
+
+def parseMem(mem):
+    """SLURM-style memory request like 16G (or a bare number of MB) in bytes, ints are taken to be bytes already."""
+    if isinstance(mem, int):
+        return mem
+    mem = str(mem).strip().upper().rstrip("B")
+    if mem[-1] in memUnits:
+        return int(float(mem[:-1]) * memUnits[mem[-1]])
+    return int(float(mem) * memUnits["M"])
+
+
+def parseWallTime(wallTime):
+    """SLURM-style time limit (minutes, minutes:seconds, hours:minutes:seconds or days-hours[:minutes[:seconds]]) in seconds."""
+    days, _, clock = str(wallTime).rpartition("-")
+    parts = [int(x) for x in clock.split(":")]
+    if days:
+        hours, minutes, seconds = parts + [0] * (3 - len(parts))
+    elif len(parts) == 3:
+        hours, minutes, seconds = parts
+    else:
+        hours, minutes, seconds = 0, parts[0], parts[1] if len(parts) == 2 else 0
+    return ((int(days or 0) * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+def getTotalMem():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class LocalJobRunner:
+    """
+    Runs shell commands as local processes packed into a memory budget.
+
+    Args:
+        memBudget (int or str, optional): Memory the running tasks may request in total, in bytes or SLURM style.
+            Defaults to the machine's total memory.
+        maxProcs (int, optional): Most tasks run at once. Defaults to the cpu count.
+        runtimeFileName (str, optional): TSV to also write the runtime table to. Defaults to None.
+        pollInterval (float, optional): Seconds between checks of the running tasks. Defaults to 1.
+    """
+
+    def __init__(self, memBudget=None, maxProcs=None, runtimeFileName=None, pollInterval=1.0):
+        self.memBudget = getTotalMem() if memBudget is None else parseMem(memBudget)
+        self.maxProcs = maxProcs or os.cpu_count()
+        self.runtimeFileName = runtimeFileName
+        self.pollInterval = pollInterval
+        self.queued, self.running, self.finished = [], [], []
+
+    def submit(self, cmd, jobName, wallTime, mem, logFileName):
+        """Queues a command, starting it right away if it fits."""
+        task = {
+            "cmd": cmd,
+            "name": jobName,
+            "timeLimit": parseWallTime(wallTime),
+            "mem": parseMem(mem),
+            "log": logFileName,
+        }
+        if task["mem"] > self.memBudget:
+            sys.stderr.write(f"warning: {jobName} requests {mem}, more than the memory budget, it will run alone\n")
+        self.queued.append(task)
+        self.update()
+
+    def update(self):
+        """Collects finished tasks, kills any past their wall time and starts queued tasks that now fit."""
+        now = time.time()
+        for task in list(self.running):
+            if task["proc"].poll() is None and now - task["start"] > task["timeLimit"]:
+                # the shell and everything it started, killing the shell alone would leave the job running
+                try:
+                    os.killpg(task["proc"].pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                task["proc"].wait()
+                task["timedOut"] = True
+            if task["proc"].poll() is not None:
+                task["seconds"] = now - task["start"]
+                task["logFile"].close()
+                self.running.remove(task)
+                self.finished.append(task)
+
+        # first fit: any queued task that fits is started, not only the first one in line
+        for task in list(self.queued):
+            memInUse = sum(t["mem"] for t in self.running)
+            if len(self.running) >= self.maxProcs:
+                break
+            if memInUse + task["mem"] <= self.memBudget or not self.running:
+                self.start(task)
+
+    def start(self, task):
+        if os.path.dirname(task["log"]):
+            os.makedirs(os.path.dirname(task["log"]), exist_ok=True)
+        task["logFile"] = open(task["log"], "wb")
+        task["start"] = time.time()
+        task["timedOut"] = False
+        # its own session, so the job's process group can be killed as a whole
+        task["proc"] = subprocess.Popen(
+            task["cmd"], shell=True, stdout=task["logFile"], stderr=subprocess.STDOUT, start_new_session=True
+        )
+        self.queued.remove(task)
+        self.running.append(task)
+
+    def wait(self):
+        """Blocks until every submitted task is done and reports their runtimes."""
+        if not self.queued and not self.running:
+            return
+        while self.queued or self.running:
+            self.update()
+            if self.queued or self.running:
+                time.sleep(self.pollInterval)
+        self.reportRuntimes()
+
+    def reportRuntimes(self):
+        lines = ["name\tstatus\tseconds\tmem\tlog\tcmd\n"]
+        for task in self.finished:
+            status = "timeout" if task["timedOut"] else f"exit {task['proc'].returncode}"
+            lines.append(f"{task['name']}\t{status}\t{task['seconds']:.1f}\t{task['mem'] / memUnits['G']:.1f}G\t{task['log']}\t{task['cmd']}\n")
+        sys.stderr.write("".join(lines))
+        failed = [task for task in self.finished if task["timedOut"] or task["proc"].returncode != 0]
+        sys.stderr.write(f"{len(self.finished) - len(failed)} of {len(self.finished)} tasks succeeded\n")
+        if self.runtimeFileName is not None:
+            if os.path.dirname(self.runtimeFileName):
+                os.makedirs(os.path.dirname(self.runtimeFileName), exist_ok=True)
+            with open(self.runtimeFileName, "wt") as runtimeFile:
+                runtimeFile.write("".join(lines))
+
+
+runner = LocalJobRunner()
+atexit.register(runner.wait)
+
+
+def configure(memBudget=None, maxProcs=None, runtimeFileName=None):
+    """Sets the memory budget, process limit and runtime table file of the runner used by the functions below."""
+    if memBudget is not None:
+        runner.memBudget = parseMem(memBudget)
+    if maxProcs is not None:
+        runner.maxProcs = maxProcs
+    if runtimeFileName is not None:
+        runner.runtimeFileName = runtimeFileName
+
+
+def runCmdAsJobWithoutWaitingWithLog(cmd, jobName, slurmFileName, wallTime, partition, mem, logFileName):
+    """Same arguments as runCmdAsJob's, the SLURM script name and partition are ignored."""
+    runner.submit(cmd, jobName, wallTime, mem, logFileName)
+
+
+def waitForJobs():
+    runner.wait()
@@ -0,0 +1,317 @@
+"""
+Aligns the comparison files written by 5_makeComparisonFile.py for every replicate into (positions, reps) matrices,
+so that top hits of one replicate can be looked up in all the others with array indexing instead of per-position
+dict lookups. Shared by 2_checkReplication.py (top hits by TimeSweeper score) and 3_checkReplicationFET.py (top hits
+by FET score).
+
+A rep matrix is a dict of:
+    chromNames  chromosomes in the order given to buildRepMatrix
+    chroms      (positions,) index into chromNames of each position
+    positions   (positions,) positions sorted by chromosome and then position
+    reps        replicate numbers, the column order of the matrices below
+    present     (positions, reps) whether the rep has a comparison line for the position
+    ts          (positions, reps) TimeSweeper score, nan where not present
+    fet         (positions, reps) -log10(p-value) of the rep's own FET, nan where not present
+    maxOtherFet (positions, reps) largest FET score of the other reps, nan where not present
+    freqs       (positions, reps, gens) frequency trajectory, nan where not present
+    cmh         (positions,) -log10(p-value) of the CMH test, only if buildRepMatrix was given a p-value table
+
+Hits can be ranked by any of ts, fet, maxOtherFet or cmh, or by several of them with the later ones breaking ties.
+How often hits replicate can be compared with random position sets, either matched to the hits or circularly shifted
+along each chromosome, by permutationNull (used by 6_replicationNull.py).
+"""
+
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sync_cache import loadPvalTable
+
+
+# positions are well below 2**40, so (chrom, position) pairs can be sorted and matched as one int64
+chromShift = 40
+
+
+def readCompFile(compFileName):
+    """Reads a comparison file into a DataFrame of c, p, ts, fet, maxOtherFet and the frequency columns, or None if it can't be read."""
+    try:
+        # round_trip parsing gives the same floats as float(), so scores are written back out unchanged
+        compDf = pd.read_csv(compFileName, sep=r"\s+", header=None, float_precision="round_trip")
+    except Exception as err:
+        print('Error reading compFile:', err)
+        return None
+    compDf.columns = ["c", "p", "ts", "fet", "maxOtherFet"] + list(range(compDf.shape[1] - 5))
+    compDf["c"] = compDf["c"].astype(str)
+    return compDf
+
+
+def buildRepMatrix(compFileNames, chromNames, reps, pvalTableDir=None):
+    """
+    Reads and aligns the comparison files of every rep.
+
+    Args:
+        compFileNames (dict[tuple[int, str], str]): Comparison file of each (rep, chrom).
+        chromNames (list[str]): Chromosomes to read.
+        reps (list[int]): Replicates to read.
+        pvalTableDir (str, optional): P-value table made by sync_cache.py to add CMH scores from. Defaults to None.
+
+    Returns:
+        dict: Rep matrix as described above.
+    """
+    chromIndices = {chrom: i for i, chrom in enumerate(chromNames)}
+    repKeys, repData = [], []
+    for rep in reps:
+        repDfs = [compDf for compDf in (readCompFile(compFileNames[(rep, chrom)]) for chrom in chromNames) if compDf is not None]
+        repDf = pd.concat(repDfs, ignore_index=True) if repDfs else None
+        if repDf is None or len(repDf) == 0:
+            repKeys.append(np.empty(0, dtype=np.int64))
+            repData.append(None)
+            continue
+
+        keys = (repDf["c"].map(chromIndices).to_numpy(dtype=np.int64) << chromShift) + repDf["p"].to_numpy(dtype=np.int64)
+        assert len(np.unique(keys)) == len(keys), f"rep {rep} has more than one comparison line for a position"
+        repKeys.append(keys)
+        repData.append(repDf)
+
+    allKeys = np.unique(np.concatenate(repKeys))
+    numGens = max([repDf.shape[1] - 5 for repDf in repData if repDf is not None], default=0)
+    repMatrix = {
+        "chromNames": list(chromNames),
+        "chroms": (allKeys >> chromShift).astype(np.int64),
+        "positions": allKeys & ((1 << chromShift) - 1),
+        "reps": list(reps),
+        "present": np.zeros((len(allKeys), len(reps)), dtype=bool),
+        "ts": np.full((len(allKeys), len(reps)), np.nan),
+        "fet": np.full((len(allKeys), len(reps)), np.nan),
+        "maxOtherFet": np.full((len(allKeys), len(reps)), np.nan),
+        "freqs": np.full((len(allKeys), len(reps), numGens), np.nan),
+    }
+    for repIndex, (keys, repDf) in enumerate(zip(repKeys, repData)):
+        if repDf is None:
+            continue
+        rows = np.searchsorted(allKeys, keys)
+        repMatrix["present"][rows, repIndex] = True
+        repMatrix["ts"][rows, repIndex] = repDf["ts"].to_numpy(dtype=np.float64)
+        repMatrix["fet"][rows, repIndex] = repDf["fet"].to_numpy(dtype=np.float64)
+        repMatrix["maxOtherFet"][rows, repIndex] = repDf["maxOtherFet"].to_numpy(dtype=np.float64)
+        repMatrix["freqs"][rows, repIndex] = repDf.iloc[:, 5:].to_numpy(dtype=np.float64)
+
+    if pvalTableDir is not None:
+        repMatrix["cmh"] = np.full(len(allKeys), np.nan)
+        for chromIndex, chrom in enumerate(chromNames):
+            rows = np.flatnonzero(repMatrix["chroms"] == chromIndex)
+            tablePositions, tablePvals = loadPvalTable(pvalTableDir, chrom)
+            if len(tablePositions) == 0:
+                continue
+            tableRows = np.searchsorted(tablePositions, repMatrix["positions"][rows]).clip(max=len(tablePositions) - 1)
+            found = tablePositions[tableRows] == repMatrix["positions"][rows]
+            # pvals column 0 is the CMH test
+            repMatrix["cmh"][rows[found]] = tablePvals[tableRows[found], 0]
+
+    return repMatrix
+
+
+def getRankScores(repMatrix, rep, scoreName):
+    if scoreName == "cmh":
+        return repMatrix["cmh"]
+    return repMatrix[scoreName][:, repMatrix["reps"].index(rep)]
+
+
+def getTopHits(repMatrix, rep, rankBy, thresholds, tops):
+    """
+    Selects the rep's top positions for every combination of threshold and number of hits in one pass.
+
+    Only the largest number of hits is selected from the scores, with argpartition, and sorted. Ties are kept
+    together at the cutoff, so the result is the same as fully sorting every position above the threshold.
+
+    Args:
+        repMatrix (dict): Rep matrix from buildRepMatrix.
+        rep (int): Replicate to select hits of.
+        rankBy (str or list[str]): Score to rank by, or scores with later ones breaking ties of earlier ones.
+            Remaining ties are broken by chromosome name and then position. Missing scores rank last.
+        thresholds (list[float]): Only positions the rep has, with a first rankBy score above the threshold, are hits.
+        tops (list[int]): Numbers of hits to select.
+
+    Returns:
+        dict[tuple[float, int], np.arr]: Rows of the hits for each (threshold, top), in ascending rank order.
+    """
+    rankBy = [rankBy] if isinstance(rankBy, str) else list(rankBy)
+    rankScores = [getRankScores(repMatrix, rep, scoreName) for scoreName in rankBy]
+    primary = rankScores[0]
+
+    # cmh scores are per position rather than per rep, so positions the rep doesn't have must be left out here
+    candidates = np.flatnonzero(repMatrix["present"][:, repMatrix["reps"].index(rep)] & (primary > min(thresholds)))
+    maxTop = max(tops)
+    if len(candidates) > maxTop:
+        cutoff = primary[candidates][np.argpartition(primary[candidates], len(candidates) - maxTop)[len(candidates) - maxTop]]
+        candidates = candidates[primary[candidates] >= cutoff]
+
+    chromRanks = np.argsort(np.argsort(repMatrix["chromNames"]))
+    sortKeys = [repMatrix["positions"][candidates], chromRanks[repMatrix["chroms"][candidates]]]
+    sortKeys += [np.nan_to_num(scores[candidates], nan=-np.inf) for scores in reversed(rankScores)]
+    candidates = candidates[np.lexsort(sortKeys)]
+
+    topHits = {}
+    for threshold in thresholds:
+        # candidates are sorted by the first rankBy score, so the hits above a threshold are always a suffix
+        aboveThreshold = candidates[primary[candidates] > threshold]
+        for top in tops:
+            topHits[(threshold, top)] = aboveThreshold[-top:] if top > 0 else aboveThreshold[:0]
+
+    return topHits
+
+
+def writeRepComp(repMatrix, rep, bestHits, outFileName):
+    """
+    Writes the rep's scores and frequencies at each best hit followed by those of the other reps that have the position.
+
+    Returns:
+        tuple[int, int]: Number of other rep lookups that found the position, and the total number of lookups.
+    """
+    repIndex = repMatrix["reps"].index(rep)
+    otherRepIndices = [i for i in range(len(repMatrix["reps"])) if i != repIndex]
+    chromNames = repMatrix["chromNames"]
+    present = repMatrix["present"][bestHits][:, otherRepIndices]
+
+    lines = []
+    for row, otherPresent in zip(bestHits.tolist(), present):
+        others = [otherRepIndices[i] for i in np.flatnonzero(otherPresent)]
+        otherTsScoreStr = "|".join([str(x) for x in repMatrix["ts"][row, others].tolist()])
+        otherFetScoreStr = "|".join([str(x) for x in repMatrix["fet"][row, others].tolist()])
+        otherFreqVelsStr = "|".join([str(x) for x in repMatrix["freqs"][row, others].tolist()])
+        chrom, pos = chromNames[repMatrix["chroms"][row]], repMatrix["positions"][row]
+        tsScore, fetScore = repMatrix["ts"][row, repIndex], repMatrix["fet"][row, repIndex]
+        freqVel = repMatrix["freqs"][row, repIndex].tolist()
+        lines.append(f"{chrom}\t{pos}\t{tsScore}\t{fetScore}\t{freqVel}\t{otherTsScoreStr}\t{otherFetScoreStr}\t{otherFreqVelsStr}\n")
+
+    with open(outFileName, 'wt') as outFile:
+        outFile.write("".join(lines))
+
+    return int(present.sum()), present.size
+
+
+def getReplicationCounts(repMatrix, rep, rowSets, scoreName, threshold):
+    """
+    Counts the other reps' scores above threshold over each set of rows.
+
+    Args:
+        repMatrix (dict): Rep matrix from buildRepMatrix.
+        rep (int): Focal replicate, left out of the counts.
+        rowSets (np.arr): (sets, hits) rows, or (hits,) for a single set.
+        scoreName (str): ts or fet.
+        threshold (float): Scores above it count as replicated.
+
+    Returns:
+        tuple[np.arr, np.arr]: Number of other rep scores above threshold and number of other rep scores present, per set.
+    """
+    repIndex = repMatrix["reps"].index(rep)
+    otherRepIndices = [i for i in range(len(repMatrix["reps"])) if i != repIndex]
+    otherScores = repMatrix[scoreName][:, otherRepIndices]
+    otherPresent = repMatrix["present"][:, otherRepIndices]
+
+    rowSets = np.atleast_2d(rowSets)
+    # missing scores are nan and never above threshold
+    replicated = (otherScores[rowSets] > threshold).sum(axis=(1, 2))
+    present = otherPresent[rowSets].sum(axis=(1, 2))
+    return replicated, present
+
+
+def drawMatchedRows(repMatrix, rep, hitRows, matchOn, numPerms, rng, numBins=20):
+    """
+    Draws random sets of the focal rep's positions with the same distribution of a covariate as the hits. Each hit is
+    replaced by a position drawn (with replacement) from the same covariate bin.
+
+    Args:
+        matchOn (str): freq to match on the rep's starting allele frequency, split into numBins quantile bins, or
+            coverage to match on the number of other reps that have the position.
+
+    Returns:
+        np.arr: (numPerms, hits) rows.
+    """
+    repIndex = repMatrix["reps"].index(rep)
+    pool = np.flatnonzero(repMatrix["present"][:, repIndex])
+    if matchOn == "freq":
+        covariate = repMatrix["freqs"][:, repIndex, 0]
+        binEdges = np.unique(np.quantile(covariate[pool], np.linspace(0, 1, numBins + 1)[1:-1]))
+        bins = np.searchsorted(binEdges, covariate, side="right")
+    elif matchOn == "coverage":
+        bins = repMatrix["present"].sum(axis=1) - 1
+    else:
+        raise ValueError(f"Can't match on {matchOn}, use freq or coverage")
+
+    permRows = np.empty((numPerms, len(hitRows)), dtype=np.int64)
+    for binValue in np.unique(bins[hitRows]):
+        hitCols = np.flatnonzero(bins[hitRows] == binValue)
+        binPool = pool[bins[pool] == binValue]
+        permRows[:, hitCols] = binPool[rng.integers(0, len(binPool), (numPerms, len(hitCols)))]
+
+    return permRows
+
+
+def drawShiftedRows(repMatrix, rep, hitRows, numPerms, rng):
+    """
+    Circularly shifts the hits along each chromosome by a random number of the focal rep's positions, one shift per
+    chromosome and set. Spacing between hits on a chromosome, and so their linkage, is kept.
+
+    Returns:
+        np.arr: (numPerms, hits) rows.
+    """
+    repIndex = repMatrix["reps"].index(rep)
+    # rows are sorted by chromosome and position, so each chromosome's positions are one slice of the pool
+    pool = np.flatnonzero(repMatrix["present"][:, repIndex])
+    chromStarts = np.searchsorted(repMatrix["chroms"][pool], np.arange(len(repMatrix["chromNames"]) + 1))
+    chromSizes = np.diff(chromStarts)
+
+    hitChroms = repMatrix["chroms"][hitRows]
+    hitIndices = np.searchsorted(pool, hitRows) - chromStarts[hitChroms]
+    shifts = rng.integers(0, np.iinfo(np.int64).max, (numPerms, len(chromSizes))) % np.maximum(chromSizes, 1)
+    shiftedIndices = (hitIndices + shifts[:, hitChroms]) % chromSizes[hitChroms]
+
+    return pool[chromStarts[hitChroms] + shiftedIndices]
+
+
+def permutationNull(repMatrix, rep, hitRows, scoreName, threshold, method, numPerms=1000, seed=None, batchSize=1000):
+    """
+    Compares how often the hits replicate in the other reps with random position sets drawn by method.
+
+    Args:
+        repMatrix (dict): Rep matrix from buildRepMatrix.
+        rep (int): Focal replicate the hits are from.
+        hitRows (np.arr): Rows of the hits, e.g. from getTopHits. Every hit must be present in the focal rep.
+        scoreName (str): ts or fet.
+        threshold (float): Other rep scores above it count as replicated.
+        method (str): circular for per-chromosome circular shifts, or freq or coverage for matched draws.
+        numPerms (int, optional): Number of random sets. Defaults to 1000.
+        seed (int, optional): Random seed. Defaults to None.
+        batchSize (int, optional): Random sets drawn and counted at once. Defaults to 1000.
+
+    Returns:
+        dict: Observed count, the null counts of every random set and the one-sided empirical p-value.
+    """
+    rng = np.random.default_rng(seed)
+    hitRows = np.asarray(hitRows)
+    if not repMatrix["present"][hitRows, repMatrix["reps"].index(rep)].all():
+        raise ValueError(f"Every hit must be a position rep {rep} has")
+    observed, observedPresent = getReplicationCounts(repMatrix, rep, hitRows, scoreName, threshold)
+
+    nullCounts, nullPresent = [], []
+    for batchStart in range(0, numPerms, batchSize):
+        batchPerms = min(batchSize, numPerms - batchStart)
+        if method == "circular":
+            permRows = drawShiftedRows(repMatrix, rep, hitRows, batchPerms, rng)
+        else:
+            permRows = drawMatchedRows(repMatrix, rep, hitRows, method, batchPerms, rng)
+        replicated, present = getReplicationCounts(repMatrix, rep, permRows, scoreName, threshold)
+        nullCounts.append(replicated)
+        nullPresent.append(present)
+    nullCounts, nullPresent = np.concatenate(nullCounts), np.concatenate(nullPresent)
+
+    return {
+        "observed": int(observed[0]),
+        "observedPresent": int(observedPresent[0]),
+        "nullCounts": nullCounts,
+        "nullPresent": nullPresent,
+        "pValue": (1 + (nullCounts >= observed[0]).sum()) / (1 + numPerms),
+    }
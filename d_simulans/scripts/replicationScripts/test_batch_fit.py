@@ -0,0 +1,44 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workflow"))
+from batch_fit import fit_batch
+
+# the per-SNP FIT that find_sweeps_npz.py used before fit_batch
+frequency_increment_test = pytest.importorskip("timesweeper.utils.frequency_increment_test")
+
+
+def makeFreqs(rng, numSnps=200, numTimepoints=7):
+    freqs = rng.random((numSnps, numTimepoints))
+    # lost or fixed partway through, then back in the middle
+    freqs[10:20, 3:] = 1
+    freqs[20:30, :4] = 0
+    freqs[30:40, 2:5] = rng.choice([0.0, 1.0], (10, 3))
+    freqs[40:45, 1:] = 0
+    freqs[45:50] = np.nan
+    freqs[50:55, 4] = np.nan
+    return freqs
+
+
+def checkMatchesFit(freqs, gens):
+    tvals, pvals = fit_batch(freqs, gens)
+    gens = np.broadcast_to(gens, freqs.shape)
+    for snp in range(len(freqs)):
+        tval, pval = frequency_increment_test.fit(list(freqs[snp]), list(gens[snp]))
+        np.testing.assert_allclose([tvals[snp], pvals[snp]], [tval, pval], rtol=1e-9, equal_nan=True, err_msg=f"snp {snp}")
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_matches_fit_with_shared_gens():
+    checkMatchesFit(makeFreqs(np.random.default_rng(0)), np.arange(0, 70, 10))
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_matches_fit_with_gens_per_snp():
+    rng = np.random.default_rng(1)
+    freqs = makeFreqs(rng)
+    gens = np.cumsum(rng.integers(1, 15, freqs.shape), axis=1)
+    checkMatchesFit(freqs, gens)
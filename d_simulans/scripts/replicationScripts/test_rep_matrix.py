@@ -0,0 +1,68 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from rep_matrix import buildRepMatrix, drawShiftedRows, getTopHits, permutationNull
+from sync_cache import writePvalTable
+
+chromNames = ["2L", "X"]
+reps = [1, 2, 3]
+
+
+def writeCompFiles(outDir, rng):
+    """Comparison files where rep 1 lacks every other position, which are also the ones with the highest CMH scores."""
+    allPositions = np.arange(1000, 1400, 2)
+    compFileNames = {}
+    for rep in reps:
+        for chrom in chromNames:
+            positions = allPositions[::2] if rep == 1 else allPositions
+            compFileNames[(rep, chrom)] = os.path.join(outDir, f"rep{rep}ScoreComp{chrom}.txt")
+            with open(compFileNames[(rep, chrom)], "wt") as compFile:
+                for pos in positions:
+                    freqs = "\t".join(f"{x:.4f}" for x in rng.random(7))
+                    compFile.write(f"{chrom}\t{pos}\t{rng.random():.3f}\t{rng.exponential(5)}\t{rng.exponential(5)}\t{freqs}\n")
+    return compFileNames
+
+
+@pytest.fixture
+def repMatrix(tmp_path):
+    rng = np.random.default_rng(0)
+    compFileNames = writeCompFiles(str(tmp_path), rng)
+    repMatrix = buildRepMatrix(compFileNames, chromNames, reps)
+
+    pvals = rng.exponential(3, (len(repMatrix["positions"]), 1 + len(reps)))
+    pvals[~repMatrix["present"][:, 0], 0] += 100
+    writePvalTable(str(tmp_path / "pvalTable"), repMatrix["chroms"], repMatrix["positions"], pvals, chromNames)
+    return buildRepMatrix(compFileNames, chromNames, reps, str(tmp_path / "pvalTable"))
+
+
+def test_cmh_hits_are_positions_of_the_rep(repMatrix):
+    present = repMatrix["present"][:, 0]
+    assert not present.all()
+
+    topHits = getTopHits(repMatrix, 1, "cmh", [0.0, 2.0], [10, 50])
+    for (threshold, top), hitRows in topHits.items():
+        assert present[hitRows].all()
+        # the same as fully sorting the rep's positions above the threshold
+        expected = [row for row in np.flatnonzero(present & (repMatrix["cmh"] > threshold))]
+        expected.sort(key=lambda row: (repMatrix["cmh"][row], repMatrix["chroms"][row], repMatrix["positions"][row]))
+        assert hitRows.tolist() == expected[-top:]
+
+
+def test_shifted_null_draws_positions_of_the_rep(repMatrix):
+    hitRows = getTopHits(repMatrix, 1, ["cmh", "ts"], [0.0], [20])[(0.0, 20)]
+    permRows = drawShiftedRows(repMatrix, 1, hitRows, 100, np.random.default_rng(1))
+    assert repMatrix["present"][permRows, 0].all()
+    assert (repMatrix["chroms"][permRows] == repMatrix["chroms"][hitRows]).all()
+
+    null = permutationNull(repMatrix, 1, hitRows, "fet", 5.0, "circular", numPerms=100, seed=1)
+    assert len(null["nullCounts"]) == 100
+
+
+def test_null_rejects_hits_missing_from_the_rep(repMatrix):
+    missingRows = np.flatnonzero(~repMatrix["present"][:, 0])[:5]
+    with pytest.raises(ValueError):
+        permutationNull(repMatrix, 1, missingRows, "fet", 5.0, "circular", numPerms=10)
@@ -0,0 +1,223 @@
+"""
+One-time import of the E&R sync file into a directory of .npy arrays that can be memory-mapped,
+so that encoding experiments and comparisons don't have to re-parse the text file every time.
+
+Arrays written to the cache dir:
+    counts.npy      (snps, reps, gens, 6) A:T:C:G:N:del base counts, uint16 (uint32 if any count doesn't fit)
+    chroms.npy      (snps,) index into chromNames.npy of each snp's chromosome
+    chromNames.npy  chromosome names in the order they appear in the sync file
+    positions.npy   (snps,) position of each snp
+    reps.npy        (reps,) replicate numbers
+    gens.npy        (gens,) generation of each timepoint
+    pvals.npy       (snps, 1 + reps) -log10(p-value) of the CMH test followed by the FET of each rep, nan where the sync file has na
+
+The CMH and FET columns are also written to a chromosome-sorted p-value table in <cache dir>/pvalTable so that
+comparisons can load a single chromosome without touching the rest of the genome:
+    chromNames.npy    chromosome names
+    chromOffsets.npy  (chroms + 1,) the snps of chromNames[i] are rows chromOffsets[i]:chromOffsets[i+1]
+    positions.npy     (snps,) position of each snp, sorted within each chromosome
+    pvals.npy         (snps, 1 + reps) as above
+    reps.npy          (reps,) replicate numbers
+
+usage: python sync_cache.py <sync file> <cache dir>
+       python sync_cache.py --pvals-only <sync file> <table dir>    only writes the p-value table, to <table dir>
+"""
+
+import os
+import sys
+import numpy as np
+
+
+reps = list(range(1, 11))
+gens = [0, 10, 20, 30, 40, 50, 60]
+
+# column names from README_for_F0-F60SNP_CMH_FET_blockID.sync.docx
+header = ["Chromosome", "position", "base"]
+header += [f"Dsim_Fl_Base_{rep}" for rep in reps]
+header += [f"Dsim_Fl_Hot_F{gen}_{rep}" for gen in gens[1:] for rep in reps]
+header += ["-log10(pvalue)_CMH"] + [f"-log10(p-value)_FET_rep{rep}" for rep in reps]
+header += ["blockID_0.75cor", "blockID_0.35cor"]
+
+pvalCols = [header.index("-log10(pvalue)_CMH")] + [header.index(f"-log10(p-value)_FET_rep{rep}") for rep in reps]
+chunkSize = 100000
+
+
+def getRepAndGen(headerEntry):
+    genInfo, repInfo = headerEntry.split("_")[-2:]
+    rep = int(repInfo)
+    if genInfo == "Base":
+        gen = 0
+    else:
+        gen = int(genInfo.lstrip("F"))
+    return rep, gen
+
+
+def getSampleCols():
+    # sync column of each (rep, gen) sample, flattened in rep-major order to match the counts array
+    sampleCols = {}
+    for i in range(len(header)):
+        if "Dsim" in header[i]:
+            sampleCols[getRepAndGen(header[i])] = i
+    return [sampleCols[(rep, gen)] for rep in reps for gen in gens]
+
+
+def parsePvals(lines):
+    return [[float(line[i]) if line[i] != "na" else np.nan for i in pvalCols] for line in lines]
+
+
+def countLines(fileName):
+    # a last line without a newline is counted too, it's still read as a line when parsing
+    numLines, lastByte = 0, b"\n"
+    with open(fileName, "rb") as f:
+        for block in iter(lambda: f.read(1 << 24), b""):
+            numLines += block.count(b"\n")
+            lastByte = block[-1:]
+    return numLines + (lastByte != b"\n")
+
+
+def writeChunk(lines, startIndex, cache, chromNames):
+    sampleCols = getSampleCols()
+    n = len(lines)
+
+    countStr = " ".join([line[i] for line in lines for i in sampleCols]).replace(":", " ")
+    counts = np.fromstring(countStr, dtype=np.uint32, sep=" ").reshape(n, len(reps), len(gens), 6)
+    if counts.max() > np.iinfo(cache["counts"].dtype).max:
+        raise OverflowError(f"base counts don't fit in {cache['counts'].dtype}")
+    cache["counts"][startIndex : startIndex + n] = counts
+
+    for i in range(n):
+        if not lines[i][0] in chromNames:
+            chromNames.append(lines[i][0])
+    chromIndices = {chrom: i for i, chrom in enumerate(chromNames)}
+    cache["chroms"][startIndex : startIndex + n] = [chromIndices[line[0]] for line in lines]
+    cache["positions"][startIndex : startIndex + n] = [int(line[1]) for line in lines]
+    cache["pvals"][startIndex : startIndex + n] = parsePvals(lines)
+
+
+def importSync(syncFileName, cacheDir, countDtype=np.uint16):
+    os.makedirs(cacheDir, exist_ok=True)
+    numSnps = countLines(syncFileName)
+    sys.stderr.write(f"importing {numSnps} snps from {syncFileName}\n")
+
+    def openArray(name, dtype, shape):
+        return np.lib.format.open_memmap(os.path.join(cacheDir, f"{name}.npy"), mode="w+", dtype=dtype, shape=shape)
+
+    cache = {
+        "counts": openArray("counts", countDtype, (numSnps, len(reps), len(gens), 6)),
+        "chroms": openArray("chroms", np.uint16, (numSnps,)),
+        "positions": openArray("positions", np.int64, (numSnps,)),
+        "pvals": openArray("pvals", np.float64, (numSnps, len(pvalCols))),
+    }
+    chromNames = []
+
+    lines, startIndex = [], 0
+    with open(syncFileName, "rt") as inFile:
+        for line in inFile:
+            lines.append(line.strip().split())
+            if len(lines) == chunkSize:
+                writeChunk(lines, startIndex, cache, chromNames)
+                startIndex += len(lines)
+                lines = []
+                sys.stderr.write(f"\t{startIndex} snps done\n")
+    if lines:
+        writeChunk(lines, startIndex, cache, chromNames)
+        startIndex += len(lines)
+    assert startIndex == numSnps
+
+    for name in cache:
+        cache[name].flush()
+    np.save(os.path.join(cacheDir, "chromNames.npy"), np.array(chromNames))
+    np.save(os.path.join(cacheDir, "reps.npy"), np.array(reps))
+    np.save(os.path.join(cacheDir, "gens.npy"), np.array(gens))
+
+    writePvalTable(os.path.join(cacheDir, "pvalTable"), cache["chroms"], cache["positions"], cache["pvals"], chromNames)
+
+
+def writePvalTable(tableDir, chroms, positions, pvals, chromNames):
+    """Writes the p-value table, sorting snps by chromosome and then by position."""
+    os.makedirs(tableDir, exist_ok=True)
+    order = np.lexsort((positions, chroms))
+    chromOffsets = np.searchsorted(chroms[order], np.arange(len(chromNames) + 1))
+
+    np.save(os.path.join(tableDir, "chromNames.npy"), np.array(chromNames))
+    np.save(os.path.join(tableDir, "chromOffsets.npy"), chromOffsets)
+    np.save(os.path.join(tableDir, "positions.npy"), np.asarray(positions, dtype=np.int64)[order])
+    np.save(os.path.join(tableDir, "pvals.npy"), np.asarray(pvals, dtype=np.float64)[order])
+    np.save(os.path.join(tableDir, "reps.npy"), np.array(reps))
+
+
+def readPvalChunk(lines, table, chromNames):
+    for line in lines:
+        if not line[0] in chromNames:
+            chromNames.append(line[0])
+    chromIndices = {chrom: i for i, chrom in enumerate(chromNames)}
+    table["chroms"].append(np.array([chromIndices[line[0]] for line in lines], dtype=np.uint16))
+    table["positions"].append(np.array([int(line[1]) for line in lines], dtype=np.int64))
+    table["pvals"].append(np.array(parsePvals(lines), dtype=np.float64))
+
+
+def importPvals(syncFileName, tableDir):
+    """Writes the p-value table straight from the sync file, skipping the base counts."""
+    sys.stderr.write(f"importing p-values from {syncFileName}\n")
+    table = {"chroms": [], "positions": [], "pvals": []}
+    chromNames = []
+
+    lines, numSnps = [], 0
+    with open(syncFileName, "rt") as inFile:
+        for line in inFile:
+            lines.append(line.strip().split())
+            if len(lines) == chunkSize:
+                readPvalChunk(lines, table, chromNames)
+                numSnps += len(lines)
+                lines = []
+                sys.stderr.write(f"\t{numSnps} snps done\n")
+    if lines:
+        readPvalChunk(lines, table, chromNames)
+
+    writePvalTable(tableDir, *[np.concatenate(table[name]) for name in ["chroms", "positions", "pvals"]], chromNames)
+
+
+def loadPvalTable(tableDir, chrom):
+    """
+    Gets the positions and CMH/FET p-values of one chromosome from a table made by writePvalTable, as read-only
+    memmaps. Both are empty if the chromosome isn't in the table.
+    """
+    chromNames = [str(c) for c in np.load(os.path.join(tableDir, "chromNames.npy"))]
+    chromOffsets = np.load(os.path.join(tableDir, "chromOffsets.npy"))
+    positions = np.load(os.path.join(tableDir, "positions.npy"), mmap_mode="r")
+    pvals = np.load(os.path.join(tableDir, "pvals.npy"), mmap_mode="r")
+    if chrom not in chromNames:
+        return positions[:0], pvals[:0]
+
+    chromIndex = chromNames.index(chrom)
+    start, end = chromOffsets[chromIndex], chromOffsets[chromIndex + 1]
+    return positions[start:end], pvals[start:end]
+
+
+def loadSyncCache(cacheDir):
+    """Opens every array in the cache dir as a read-only memmap; chromNames is returned as a list."""
+    cache = {}
+    for name in ["counts", "chroms", "positions", "pvals", "reps", "gens"]:
+        cache[name] = np.load(os.path.join(cacheDir, f"{name}.npy"), mmap_mode="r")
+    cache["chromNames"] = [str(chrom) for chrom in np.load(os.path.join(cacheDir, "chromNames.npy"))]
+    return cache
+
+
+def getChromSnpIndices(cache, chrom):
+    return np.flatnonzero(cache["chroms"] == cache["chromNames"].index(chrom))
+
+
+if __name__ == "__main__":
+    if sys.argv[1] == "--pvals-only":
+        syncFileName, tableDir = sys.argv[2:]
+        importPvals(syncFileName, tableDir)
+        sys.stderr.write("all done!\n")
+        sys.exit()
+
+    syncFileName, cacheDir = sys.argv[1:]
+    try:
+        importSync(syncFileName, cacheDir)
+    except OverflowError as err:
+        sys.stderr.write(f"{err}, re-importing with uint32 counts\n")
+        importSync(syncFileName, cacheDir, countDtype=np.uint32)
+    sys.stderr.write("all done!\n")
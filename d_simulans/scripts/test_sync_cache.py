@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from sync_cache import gens, header, importSync, loadPvalTable, loadSyncCache, pvalCols, reps
+
+
+def makeSyncLines(numSnps, rng):
+    lines = []
+    for i in range(numSnps):
+        chrom = "2L" if i < numSnps // 2 else "X"
+        samples = [":".join(str(x) for x in rng.integers(0, 50, 6)) for _ in range(len(reps) * len(gens))]
+        pvals = [f"{x:.3f}" for x in rng.exponential(3, len(pvalCols))]
+        pvals[1] = "na"
+        lines.append("\t".join([chrom, str(1000 + 10 * i), "A"] + samples + pvals + ["1", "2"]))
+        assert len(lines[-1].split("\t")) == len(header)
+    return lines
+
+
+def test_import_without_trailing_newline(tmp_path):
+    lines = makeSyncLines(5, np.random.default_rng(0))
+    for name, text in [("newline", "\n".join(lines) + "\n"), ("noNewline", "\n".join(lines))]:
+        with open(tmp_path / f"{name}.sync", "wt") as syncFile:
+            syncFile.write(text)
+        importSync(str(tmp_path / f"{name}.sync"), str(tmp_path / name))
+
+    withNewline, withoutNewline = loadSyncCache(str(tmp_path / "newline")), loadSyncCache(str(tmp_path / "noNewline"))
+    assert len(withoutNewline["positions"]) == len(lines)
+    assert withoutNewline["chromNames"] == withNewline["chromNames"] == ["2L", "X"]
+    for name in ["counts", "chroms", "positions", "pvals"]:
+        assert np.array_equal(withoutNewline[name], withNewline[name], equal_nan=True)
+
+    positions, pvals = loadPvalTable(str(tmp_path / "noNewline" / "pvalTable"), "X")
+    assert positions.tolist() == [1020, 1030, 1040]
+    assert np.isnan(pvals[:, 1]).all()
@@ -6,13 +6,14 @@
 for i in aftInputsVelocity/*3R*
     do sbatch \
         --time=2:00:00 \
-        --mem=16G \
+        --mem=8G \
         -c 4 \
         --partition=dschridelab \
         --constraint=rhel8 \
         --wrap="source activate blinx; conda activate blinx; \
             python find_sweeps_npz.py -i $i \
             -o unif_vel_0_thresh \
+            --chunk-size 100000 \
             --aft-model /pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_0_thresh_velocity_TimeSweeper_aft \
             yaml d_simulans_config.yaml" 
     done
@@ -191,3 +192,75 @@ for i in aftInputs/*
             --aft-model /pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_log_uni_25_thresh_vel_TimeSweeper_aft \
             yaml d_simulans_config.yaml" 
     done
+
+###############################################
+
+####All velocity models in one pass per input
+#Each input is loaded once and scored by every model, predictions go to ./<label>/ as above
+for i in aftInputsVelocity/*
+    do sbatch \
+        --time=2:00:00 \
+        --mem=8G \
+        -c 4 \
+        --partition=dschridelab \
+        --constraint=rhel8 \
+        --wrap="source activate blinx; conda activate blinx; \
+            python find_sweeps_npz.py -i $i \
+            -o . \
+            --aft-model unif_vel_0_thresh=/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_0_thresh_velocity_TimeSweeper_aft \
+            --aft-model unif_vel_25_thresh=/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_25_thresh_velocity_TimeSweeper_aft \
+            --aft-model logunif_vel_0_thresh=/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_log_uni_0_thresh_vel_TimeSweeper_aft \
+            --aft-model logunif_vel_25_thresh=/pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_log_uni_25_thresh_vel_TimeSweeper_aft \
+            yaml d_simulans_config.yaml" 
+    done
+
+####Whole genome in one job
+#All inputs in the directory are scored in a single process with the model loaded once
+sbatch \
+    --time=4:00:00 \
+    --mem=8G \
+    -c 4 \
+    --partition=dschridelab \
+    --constraint=rhel8 \
+    --wrap="source activate blinx; conda activate blinx; \
+        python find_sweeps_npz.py -i aftInputsVelocity \
+        -o unif_vel_0_thresh \
+        --chunk-size 100000 \
+        --batch-size 4096 \
+        --aft-model /pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_0_thresh_velocity_TimeSweeper_aft \
+        yaml d_simulans_config.yaml"
+
+####FIT only
+#No model or TensorFlow, so all inputs fit in one small job
+sbatch \
+    --time=1:00:00 \
+    --mem=2G \
+    --partition=dschridelab \
+    --constraint=rhel8 \
+    --wrap="source activate blinx; conda activate blinx; \
+        python find_sweeps_npz.py -i aftInputsVelocity \
+        -o fit_velocity \
+        --fit-only \
+        yaml d_simulans_config.yaml"
+
+####ONNX Runtime backend
+#Export once (writes <model>.onnx next to each model and checks its scores against Keras), then predict without TensorFlow
+python export_onnx.py \
+    -m /pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_0_thresh_velocity_TimeSweeper_aft \
+    --npz aftInputsVelocity/dsim_chrom_2L_rep_1.npz
+
+sbatch \
+    --time=4:00:00 \
+    --mem=8G \
+    -c 4 \
+    --partition=dschridelab \
+    --constraint=rhel8 \
+    --wrap="source activate blinx; conda activate blinx; \
+        python find_sweeps_npz.py -i aftInputsVelocity \
+        -o unif_vel_0_thresh \
+        --chunk-size 100000 \
+        --batch-size 4096 \
+        --backend onnx \
+        --intra-op-threads 4 \
+        --aft-model /pine/scr/l/s/lswhiteh/timesweeper-experiments/d_simulans/ts_simulans/trained_models/d_simulans_0_thresh_velocity_TimeSweeper_aft \
+        yaml d_simulans_config.yaml"
@@ -0,0 +1,74 @@
+import numpy as np
+from scipy.stats import t as t_dist
+
+# https://www.genetics.org/content/196/2/509
+# Vectorized version of timesweeper.utils.frequency_increment_test, computes the FIT for every SNP at once.
+
+
+def get_rescaled_incs_batch(freqs, gens):
+    """
+    Calculates rescaled allele frequency increments for the FIT across many SNPs at once.
+
+    Timepoints where an allele is fixed at 0 or 1 are skipped, each increment is taken between
+    consecutive timepoints where it isn't, the same as getRescaledIncs on a single SNP.
+
+    Args:
+        freqs (np.arr): Allele frequencies, shape (snps, timepoints).
+        gens (np.arr): Generation of each timepoint, shape (timepoints,) or (snps, timepoints) if sampling differs per SNP.
+
+    Returns:
+        np.arr: Rescaled increments, shape (snps, timepoints). Only valid where the mask is True.
+        np.arr: Boolean mask of which entries are increments.
+    """
+    freqs = np.asarray(freqs, dtype=np.float64)
+    gens = np.broadcast_to(np.asarray(gens, dtype=np.float64), freqs.shape)
+    num_timepoints = freqs.shape[1]
+
+    not_fixed = (freqs != 0) & (freqs != 1)
+
+    # index of the closest earlier timepoint that isn't fixed, -1 if there isn't one
+    not_fixed_idx = np.where(not_fixed, np.arange(num_timepoints), -1)
+    prev_idx = np.maximum.accumulate(not_fixed_idx, axis=1)
+    prev_idx = np.concatenate([np.full((len(freqs), 1), -1), prev_idx[:, :-1]], axis=1)
+
+    inc_mask = not_fixed & (prev_idx >= 0)
+    prev_idx = np.clip(prev_idx, 0, None)
+    prev_freqs = np.take_along_axis(freqs, prev_idx, axis=1)
+    prev_gens = np.take_along_axis(gens, prev_idx, axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        num = freqs - prev_freqs
+        denom = ((2 * prev_freqs) * (1 - prev_freqs) * (gens - prev_gens)) ** 0.5
+        incs = np.where(inc_mask, num / denom, 0.0)
+
+    return incs, inc_mask
+
+
+def fit_batch(freqs, gens):
+    """
+    Calculate FIT for many SNPs by performing a 1-sample Student t-test on each SNP's frequency increments.
+
+    Args:
+        freqs (np.arr): Allele frequencies, shape (snps, timepoints).
+        gens (np.arr): Generation of each timepoint, shape (timepoints,) or (snps, timepoints).
+
+    Returns:
+        np.arr: t statistic of each SNP, nan where there are fewer than 2 increments.
+        np.arr: Two-sided p value of each SNP, nan where there are fewer than 2 increments.
+    """
+    incs, inc_mask = get_rescaled_incs_batch(freqs, gens)
+    num_incs = inc_mask.sum(axis=1)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        mean = incs.sum(axis=1) / num_incs
+        sq_dev = np.where(inc_mask, (incs - mean[:, None]) ** 2, 0.0)
+        var = sq_dev.sum(axis=1) / (num_incs - 1)
+        tvals = mean / np.sqrt(var / num_incs)
+
+    df = num_incs - 1
+    tvals = np.where(df > 0, tvals, np.nan)
+    pvals = np.full(len(tvals), np.nan)
+    has_df = df > 0
+    pvals[has_df] = 2 * t_dist.sf(np.abs(tvals[has_df]), df[has_df])
+
+    return tvals, pvals
@@ -0,0 +1,296 @@
+"""
+Measures how find_sweeps_npz.py scales with chromosome length, batch size, thread count and input dtype.
+
+Each configuration runs in a fresh process on a synthetic input in either NPZ format, timing the load, predict,
+FIT and write stages separately so peak RSS can be reported per configuration. Results are written as JSON
+and printed as a table, e.g. to size SLURM -c and --mem requests.
+"""
+
+import argparse as ap
+import itertools
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+
+logging.basicConfig()
+logger = logging.getLogger("timesweeper")
+logger.setLevel("INFO")
+
+
+def check_dtype(dtype):
+    """Raises ValueError unless frequencies can be stored as dtype, a float type or uint8 as E_R_formatting_script.py quantizes."""
+    if np.dtype(dtype).kind != "f" and np.dtype(dtype) != np.uint8:
+        raise ValueError(f"Frequencies can't be stored as {dtype}, only as a float type or uint8")
+
+
+def make_synthetic_input(npz_path, num_windows, dtype, npz_format=1, num_timepoints=7, win_size=51, seed=42):
+    """
+    Writes an NPZ input with random-walk allele frequencies at the given scale, the way E_R_formatting_script.py
+    writes it.
+
+    Args:
+        npz_path (str): File to write, named like dsim_chrom_<chrom>_rep_<rep>.npz.
+        num_windows (int): Number of windows.
+        dtype (str): Dtype to store the frequencies as, uint8 is quantized with E_R_formatting_script.storeFreqs.
+        npz_format (int, optional): NPZ format version, 1 for aftIn/aftInPosition windows or 2 for
+            aftFreqs/aftPositions that are windowed on load. Defaults to 1.
+        num_timepoints (int, optional): Number of timepoints. Defaults to 7.
+        win_size (int, optional): SNPs per window. Defaults to 51.
+        seed (int, optional): Random seed. Defaults to 42.
+    """
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts"))
+    from E_R_formatting_script import storeFreqs
+
+    check_dtype(dtype)
+    rng = np.random.default_rng(seed)
+    # the final window is left out of both formats
+    num_snps = num_windows + win_size
+    start_freqs = rng.uniform(0.05, 0.95, num_snps)
+    steps = rng.normal(0, 0.05, (num_timepoints - 1, num_snps))
+    freqs = np.clip(np.vstack([start_freqs, start_freqs + np.cumsum(steps, axis=0)]), 0, 1)
+    positions = np.cumsum(rng.integers(1, 200, num_snps))
+    freqs, storage_info = storeFreqs(freqs, dtype)
+
+    if npz_format == 2:
+        np.savez(
+            npz_path, aftFreqs=freqs, aftPositions=positions, winSize=win_size, formatVersion=2, **storage_info
+        )
+    else:
+        aft_in = sliding_window_view(freqs, win_size, axis=1)[:, :num_windows].transpose(1, 0, 2)
+        aft_in_position = sliding_window_view(positions, win_size)[:num_windows]
+        np.savez(npz_path, aftIn=aft_in, aftInPosition=aft_in_position, **storage_info)
+
+
+def set_threads(backend, threads):
+    """Limits the threads used by TensorFlow, onnxruntime threads are set when the model is loaded instead."""
+    if backend == "keras" and threads is not None:
+        import tensorflow as tf
+
+        tf.config.threading.set_intra_op_parallelism_threads(threads)
+        tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+def run_config(bench_config):
+    """
+    Runs every stage once on one configuration, meant to be called in a fresh process.
+
+    Args:
+        bench_config (dict): Configuration, see main.
+
+    Returns:
+        dict: The configuration with the time of each stage in seconds and the peak RSS in MB added.
+    """
+    from find_sweeps_npz import load_input, load_nn, run_aft_windows, run_fit_windows, write_fit, write_preds
+
+    timings = {}
+    stage_start = time.perf_counter()
+    model = None
+    if bench_config["model"] is not None:
+        set_threads(bench_config["backend"], bench_config["threads"])
+        model = load_nn(
+            bench_config["model"], backend=bench_config["backend"], intra_op_threads=bench_config["threads"]
+        )
+    timings["model_load"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    chrom, rep, ts_aft, locs, aft_windows, gens, freq_scale = load_input(bench_config["npz_path"], False, {})
+    timings["input_load"] = time.perf_counter() - stage_start
+
+    if model is not None:
+        stage_start = time.perf_counter()
+        aft_predictions = run_aft_windows(aft_windows, locs, chrom, model, bench_config["batch_size"])
+        timings["predict"] = time.perf_counter() - stage_start
+
+    stage_start = time.perf_counter()
+    fit_predictions = run_fit_windows(ts_aft, locs, chrom, gens, freq_scale)
+    timings["fit"] = time.perf_counter() - stage_start
+
+    with tempfile.TemporaryDirectory() as outdir:
+        stage_start = time.perf_counter()
+        if model is not None:
+            write_preds(aft_predictions, f"{outdir}/aft_{chrom}_{rep}_preds.csv", False)
+        write_fit(fit_predictions, f"{outdir}/fit_{chrom}_{rep}_preds.csv")
+        timings["write"] = time.perf_counter() - stage_start
+
+    result = {k: v for k, v in bench_config.items() if k != "npz_path"}
+    result.update({f"{stage}_sec": t for stage, t in timings.items()})
+    # ru_maxrss is in KB on linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    return result
+
+
+def summarize(result, num_windows):
+    """Adds windows/sec for each stage and end to end, model loading is left out of the total."""
+    stage_secs = {k: v for k, v in result.items() if k.endswith("_sec")}
+    for key, secs in stage_secs.items():
+        if key != "model_load_sec":
+            result[key.replace("_sec", "_win_per_sec")] = num_windows / secs if secs > 0 else np.inf
+    total_secs = sum(secs for key, secs in stage_secs.items() if key != "model_load_sec")
+    result["total_win_per_sec"] = num_windows / total_secs
+
+    return result
+
+
+def run_benchmarks(ua, work_dir):
+    """Runs every combination of the requested settings, making the synthetic inputs in work_dir as needed."""
+    results = []
+    for num_windows, dtype, npz_format in itertools.product(ua.num_windows, ua.dtypes, ua.npz_formats):
+        npz_path = os.path.join(work_dir, f"dsim_chrom_bench{num_windows}{dtype}v{npz_format}_rep_1.npz")
+        if not os.path.exists(npz_path):
+            make_synthetic_input(npz_path, num_windows, dtype, npz_format)
+
+        for batch_size, threads in itertools.product(ua.batch_sizes, ua.threads):
+            bench_config = {
+                "npz_path": npz_path,
+                "model": ua.aft_model,
+                "backend": ua.backend,
+                "num_windows": num_windows,
+                "dtype": dtype,
+                "npz_format": npz_format,
+                "input_mb": os.path.getsize(npz_path) / 1e6,
+                "batch_size": batch_size,
+                "threads": threads,
+            }
+            runs = []
+            for _ in range(ua.repeats):
+                # a fresh process per run so that peak RSS and TensorFlow's thread settings are per configuration
+                with ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn")) as pool:
+                    runs.append(pool.submit(run_config, bench_config).result())
+            best = min(runs, key=lambda r: sum(v for k, v in r.items() if k.endswith("_sec")))
+            results.append(summarize(best, num_windows))
+            logger.info(
+                f"{num_windows} windows, {dtype}, format {npz_format}, batch size {batch_size}, {threads} threads: "
+                f"{results[-1]['total_win_per_sec']:.1f} windows/sec, {results[-1]['peak_rss_mb']:.0f} MB peak RSS"
+            )
+
+    return results
+
+
+def parse_ua():
+    uap = ap.ArgumentParser(
+        description="Benchmarks find_sweeps_npz.py on synthetic inputs across chromosome lengths, batch sizes, \
+            thread counts and input dtypes, reporting windows/sec, per-stage time and peak RSS."
+    )
+    uap.add_argument(
+        "--aft-model",
+        dest="aft_model",
+        help="Path to the model to benchmark, as for find_sweeps_npz.py. Without a model only the load, FIT and write stages are run.",
+        required=False,
+    )
+    uap.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["keras", "onnx"],
+        default="keras",
+        help="Inference backend, see find_sweeps_npz.py. Defaults to keras.",
+        required=False,
+    )
+    uap.add_argument(
+        "--num-windows",
+        dest="num_windows",
+        type=int,
+        nargs="+",
+        default=[10000, 100000],
+        help="Chromosome lengths to test, in windows. Defaults to 10000 100000.",
+        required=False,
+    )
+    uap.add_argument(
+        "--batch-sizes",
+        dest="batch_sizes",
+        type=int,
+        nargs="+",
+        default=[None],
+        help="Prediction batch sizes to test. Defaults to the backend default.",
+        required=False,
+    )
+    uap.add_argument(
+        "--threads",
+        dest="threads",
+        type=int,
+        nargs="+",
+        default=[None],
+        help="Intra-op thread counts to test. Defaults to the backend default.",
+        required=False,
+    )
+    uap.add_argument(
+        "--dtypes",
+        dest="dtypes",
+        nargs="+",
+        default=["float64", "float32"],
+        help="Dtypes to store the synthetic inputs as, float types or uint8 quantized as E_R_formatting_script.py does. Defaults to float64 float32.",
+        required=False,
+    )
+    uap.add_argument(
+        "--format",
+        dest="npz_formats",
+        type=int,
+        nargs="+",
+        choices=[1, 2],
+        default=[1],
+        help="NPZ format versions to write the synthetic inputs in, see npzFormatVersion in E_R_formatting_script.py. Defaults to 1.",
+        required=False,
+    )
+    uap.add_argument(
+        "--repeats",
+        dest="repeats",
+        type=int,
+        default=1,
+        help="Times to run each configuration, the fastest run is reported. Defaults to 1.",
+        required=False,
+    )
+    uap.add_argument(
+        "--work-dir",
+        dest="work_dir",
+        help="Directory for the synthetic inputs. Defaults to a temporary directory.",
+        required=False,
+    )
+    uap.add_argument(
+        "-o",
+        "--out-json",
+        dest="out_json",
+        default="inference_benchmark.json",
+        help="JSON file to write results to. Defaults to inference_benchmark.json.",
+        required=False,
+    )
+
+    return uap.parse_args()
+
+
+def main(ua):
+    for dtype in ua.dtypes:
+        check_dtype(dtype)
+    work_dir = ua.work_dir or tempfile.mkdtemp(prefix="ts_bench_")
+    os.makedirs(work_dir, exist_ok=True)
+    try:
+        results = run_benchmarks(ua, work_dir)
+    finally:
+        if ua.work_dir is None:
+            shutil.rmtree(work_dir)
+
+    with open(ua.out_json, "w") as outfile:
+        json.dump(results, outfile, indent=2)
+
+    summary_cols = ["num_windows", "dtype", "npz_format", "batch_size", "threads", "total_win_per_sec", "peak_rss_mb"]
+    summary_df = pd.DataFrame(results)
+    summary_cols += [c for c in summary_df.columns if c.endswith("_sec") and c not in summary_cols]
+    print(summary_df[summary_cols].to_string(index=False, float_format="{:.2f}".format))
+    logger.info(f"Results written to {ua.out_json}")
+
+
+if __name__ == "__main__":
+    ua = parse_ua()
+    main(ua)
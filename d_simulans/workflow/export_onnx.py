@@ -0,0 +1,162 @@
+import argparse as ap
+import logging
+import os
+import sys
+
+import numpy as np
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+
+logging.basicConfig()
+logger = logging.getLogger("timesweeper")
+logger.setLevel("INFO")
+
+
+def export_model(model, onnx_path, opset):
+    """
+    Converts a Keras model to ONNX.
+
+    Args:
+        model (Keras.model): Trained AFT or HFT model.
+        onnx_path (str): File to write the ONNX model to.
+        opset (int): ONNX opset to target.
+    """
+    import tensorflow as tf
+    import tf2onnx
+
+    input_spec = (
+        tf.TensorSpec((None,) + tuple(model.input_shape[1:]), tf.float32, name="input"),
+    )
+    tf2onnx.convert.from_keras(
+        model, input_signature=input_spec, opset=opset, output_path=onnx_path
+    )
+
+
+def get_check_windows(model, npz_path, num_windows, seed):
+    """
+    Gets windows to compare Keras and ONNX scores on.
+
+    Args:
+        model (Keras.model): Model being exported, used for the input shape.
+        npz_path (str): NPZ input to take the first windows from, or None to use random frequencies.
+        num_windows (int): Number of windows.
+        seed (int): Seed for the random frequencies.
+
+    Returns:
+        np.arr: float32 windows, shape (num_windows, timepoints, win_size).
+    """
+    if npz_path is not None:
+        from find_sweeps_npz import dequantize_freqs, get_freq_scale, load_npz
+
+        ts_aft, _ = load_npz(npz_path, mmap=True)
+        return dequantize_freqs(ts_aft[:num_windows], get_freq_scale(npz_path))
+
+    rng = np.random.default_rng(seed)
+    return rng.random((num_windows,) + tuple(model.input_shape[1:]), dtype=np.float32)
+
+
+def check_agreement(keras_model, onnx_model, windows, tolerance):
+    """
+    Checks that ONNX scores match the Keras scores on the same windows.
+
+    Args:
+        keras_model (Keras.model): Original model.
+        onnx_model (OnnxModel): Exported model run with onnxruntime.
+        windows (np.arr): Windows to predict on.
+        tolerance (float): Largest allowed absolute difference in any score.
+
+    Returns:
+        float: Largest absolute difference between the two.
+    """
+    keras_probs = keras_model.predict(windows, verbose=0)
+    onnx_probs = onnx_model.predict(windows)
+    if keras_probs.shape != onnx_probs.shape:
+        raise ValueError(f"Keras scores have shape {keras_probs.shape}, ONNX scores {onnx_probs.shape}")
+
+    max_diff = float(np.abs(keras_probs - onnx_probs).max())
+    if max_diff > tolerance:
+        raise ValueError(f"ONNX scores differ from Keras by up to {max_diff:.2e}, above tolerance {tolerance:.2e}")
+
+    return max_diff
+
+
+def parse_ua():
+    uap = ap.ArgumentParser(
+        description="Exports trained Timesweeper Keras models to ONNX for find_sweeps_npz.py --backend onnx, \
+            checking that the exported model gives the same scores."
+    )
+    uap.add_argument(
+        "-m",
+        "--model",
+        dest="models",
+        action="append",
+        help="Path to Keras2-style saved model to export, written to <model>.onnx. Can be given multiple times.",
+        required=True,
+    )
+    uap.add_argument(
+        "--npz",
+        dest="npz",
+        help="NPZ input to take the check windows from. Defaults to random frequencies.",
+        required=False,
+    )
+    uap.add_argument(
+        "--num-windows",
+        dest="num_windows",
+        type=int,
+        default=10000,
+        help="Number of windows to compare scores on. Defaults to 10000.",
+        required=False,
+    )
+    uap.add_argument(
+        "--tolerance",
+        dest="tolerance",
+        type=float,
+        default=1e-4,
+        help="Largest allowed absolute difference between Keras and ONNX scores. Defaults to 1e-4.",
+        required=False,
+    )
+    uap.add_argument(
+        "--opset",
+        dest="opset",
+        type=int,
+        default=13,
+        help="ONNX opset to target. Defaults to 13.",
+        required=False,
+    )
+    uap.add_argument(
+        "--seed",
+        dest="seed",
+        type=int,
+        default=42,
+        help="Seed for the random check windows. Defaults to 42.",
+        required=False,
+    )
+
+    return uap.parse_args()
+
+
+def main(ua):
+    from find_sweeps_npz import load_nn
+
+    failed = False
+    for model_path in ua.models:
+        keras_model = load_nn(model_path)
+        onnx_path = f"{model_path.rstrip('/')}.onnx"
+        export_model(keras_model, onnx_path, ua.opset)
+
+        onnx_model = load_nn(onnx_path, backend="onnx")
+        windows = get_check_windows(keras_model, ua.npz, ua.num_windows, ua.seed)
+        try:
+            max_diff = check_agreement(keras_model, onnx_model, windows, ua.tolerance)
+            logger.info(f"Exported {model_path} to {onnx_path}, max score difference {max_diff:.2e} on {len(windows)} windows")
+        except ValueError as err:
+            logger.error(f"{model_path}: {err}")
+            failed = True
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    ua = parse_ua()
+    main(ua)
@@ -1,15 +1,23 @@
 import argparse as ap
 import logging
 import os
-
-from itertools import cycle
+import queue
+import shutil
+import struct
+import threading
+import time
+import zipfile
+
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from glob import glob
+from itertools import cycle, islice
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 import yaml
-from tensorflow.keras.models import load_model
-from tqdm import tqdm
 
-from timesweeper.utils.frequency_increment_test import fit
+from batch_fit import fit_batch
 
 os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
 
@@ -20,23 +28,253 @@ logger.setLevel("INFO")
 pd.options.display.float_format = "{:.2f}".format
 
 
-def load_npz(npz_path):
+def mmap_npz_array(npz_path, name):
+    """
+    Memory-maps an array stored uncompressed in an NPZ file, as written by np.savez.
+
+    Args:
+        npz_path (str): Path to NPZ file.
+        name (str): Name of the array inside the NPZ.
+
+    Returns:
+        np.memmap: Read-only view of the array on disk. Compressed arrays can't be mapped and are loaded instead.
+    """
+    with zipfile.ZipFile(npz_path) as zf:
+        info = zf.getinfo(f"{name}.npy")
+    if info.compress_type != zipfile.ZIP_STORED:
+        return np.load(npz_path)[name]
+
+    with open(npz_path, "rb") as npz_file:
+        # skip the zip local file header to get to the start of the .npy member
+        npz_file.seek(info.header_offset + 26)
+        name_len, extra_len = struct.unpack("<HH", npz_file.read(4))
+        npz_file.seek(name_len + extra_len, os.SEEK_CUR)
+
+        version = np.lib.format.read_magic(npz_file)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(npz_file)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(npz_file)
+        offset = npz_file.tell()
+
+    return np.memmap(
+        npz_path,
+        dtype=dtype,
+        mode="r",
+        shape=shape,
+        order="F" if fortran_order else "C",
+        offset=offset,
+    )
+
+
+def load_npz(npz_path, mmap=False):
+    """
+    Loads windowed allele frequencies and positions from either NPZ input format.
+
+    Version 1 files hold the materialized windows in aftIn/aftInPosition.
+    Version 2 files hold the (timepoints, snps) freqs and snp positions once, windows are
+    built as zero-copy views on those. The final window is left out in both formats.
+
+    Args:
+        npz_path (str): Path to NPZ file written by E_R_formatting_script.py.
+        mmap (bool, optional): Memory-map the arrays instead of reading them into memory. Defaults to False.
+
+    Returns:
+        np.arr: Allele frequency windows, shape (windows, timepoints, win_size).
+        np.arr: SNP positions of each window, shape (windows, win_size).
+    """
     npz_obj = np.load(npz_path)
-    aft = npz_obj["aftIn"]  # (snps, timepoints, window)
-    locs = npz_obj["aftInPosition"]  # (snps, window_locs)
+    if mmap:
+        get_array = lambda name: mmap_npz_array(npz_path, name)
+    else:
+        get_array = lambda name: npz_obj[name]
+
+    if "aftFreqs" in npz_obj:
+        freqs = get_array("aftFreqs")  # (timepoints, snps)
+        positions = get_array("aftPositions")  # (snps,)
+        win_size = int(npz_obj["winSize"])
+        num_wins = len(positions) - win_size
+
+        if num_wins <= 0:
+            # fewer SNPs than a window (plus the final window that is left out), so there are no windows
+            aft = np.empty((0, freqs.shape[0], win_size), dtype=freqs.dtype)
+            locs = np.empty((0, win_size), dtype=positions.dtype)
+        else:
+            aft = sliding_window_view(freqs, win_size, axis=1)[:, :num_wins].transpose(1, 0, 2)
+            locs = sliding_window_view(positions, win_size)[:num_wins]
+    else:
+        aft = get_array("aftIn")  # (snps, timepoints, window)
+        locs = get_array("aftInPosition")  # (snps, window_locs)
 
     return aft, locs
 
 
+def get_freq_scale(npz_path):
+    """
+    Gets the scale that uint8-quantized frequencies were stored with, see freqStorage in E_R_formatting_script.py.
+
+    Returns:
+        float: Value to multiply stored frequencies by, or None if they're stored as floats.
+    """
+    npz_obj = np.load(npz_path)
+    if "freqScale" in npz_obj:
+        return float(npz_obj["freqScale"])
+
+    return None
+
+
+def dequantize_freqs(freqs, freq_scale=None, dtype=np.float32):
+    """
+    Converts stored frequencies (float64, float16 or quantized uint8) to the float32 array the model takes,
+    in one pass so there's no full-size intermediate copy.
+
+    Quantized codes above the one for a frequency of 1 (255 with a scale of 1/254) are missing frequencies
+    and read back as nan.
+
+    Args:
+        freqs (np.arr): Stored frequencies, any shape. Can be a memmap or strided view.
+        freq_scale (float, optional): Scale of quantized frequencies, see get_freq_scale. Defaults to None.
+        dtype (np.dtype, optional): Type to convert to. Defaults to np.float32.
+
+    Returns:
+        np.arr: C-contiguous frequencies of the given type.
+    """
+    if freq_scale is None:
+        return np.ascontiguousarray(freqs, dtype=dtype)
+
+    # every uint8 code looked up in a table of the frequencies they stand for
+    freq_table = np.arange(256, dtype=dtype) * np.asarray(freq_scale, dtype=dtype)
+    freq_table[round(1 / freq_scale) + 1 :] = np.nan
+
+    return np.take(freq_table, freqs)
+
+
+def get_sampled_gens(npz_path, rep, config, num_timepoints):
+    """
+    Finds the generation sampled at each timepoint, used for FIT.
+
+    Looks for a "gens" array in the NPZ first, then in the YAML config for either "gens sampled"
+    or "years sampled" with "gen time", and otherwise falls back to the D. simulans design of every 10 gens.
+    "gens sampled" can also map each rep to its own list for designs where replicates were sampled differently.
+
+    Args:
+        npz_path (str): Path to NPZ input.
+        rep (str): Replicate the input is from.
+        config (dict): YAML config.
+        num_timepoints (int): Number of timepoints in the input.
+
+    Returns:
+        np.arr: Generation of each timepoint, shape (timepoints,).
+    """
+    npz_obj = np.load(npz_path)
+    if "gens" in npz_obj:
+        gens = npz_obj["gens"]
+    elif "gens sampled" in config:
+        gens = config["gens sampled"]
+        if isinstance(gens, dict):
+            gens = gens[int(rep)]
+    elif "years sampled" in config:
+        # years before present, oldest sample first
+        years = np.array(config["years sampled"], dtype=float)
+        gens = (years.max() - years) / config["gen time"]
+    else:
+        gens = [i * 10 for i in range(7)]
+
+    gens = np.asarray(gens, dtype=float)
+    if gens.shape != (num_timepoints,):
+        raise ValueError(
+            f"{len(gens)} sampled generations found for {npz_path}, which has {num_timepoints} timepoints"
+        )
+
+    return gens
+
+
 def parse_npz_name(npz_path):
-    splitpath = npz_path.split("_")
+    splitpath = os.path.basename(npz_path).split("_")
     chrom = splitpath[2]
     rep = splitpath[-1].split(".")[0]
 
     return chrom, rep
 
 
-def run_aft_windows(ts_aft, locs, chrom, model):
+def expand_inputs(input_args):
+    """
+    Collects NPZ inputs from files, directories and glob patterns.
+
+    Args:
+        input_args (list[str]): NPZ files, directories containing NPZ files, or glob patterns.
+
+    Returns:
+        list[str]: Sorted NPZ file paths.
+    """
+    npz_paths = set()
+    for input_arg in input_args:
+        if os.path.isdir(input_arg):
+            npz_paths.update(glob(os.path.join(input_arg, "*.npz")))
+        elif os.path.exists(input_arg):
+            npz_paths.add(input_arg)
+        else:
+            npz_paths.update(glob(input_arg))
+
+    return sorted(npz_paths)
+
+
+def load_input(npz_path, mmap, config):
+    """
+    Loads an NPZ input for prediction. Unless the input is memory-mapped (predicting in chunks or FIT only)
+    the windows are decoded into one float32 array here, so that it happens on the I/O threads.
+
+    Returns:
+        tuple: chrom, rep, ts_aft as stored, locs, the decoded windows (None when memory-mapped),
+            the sampled gens and the freq scale (None unless quantized).
+    """
+    chrom, rep = parse_npz_name(npz_path)
+    ts_aft, locs = load_npz(npz_path, mmap=mmap)
+    freq_scale = get_freq_scale(npz_path)
+    if mmap:
+        aft_windows = None
+    else:
+        aft_windows = dequantize_freqs(ts_aft, freq_scale)
+    gens = get_sampled_gens(npz_path, rep, config, ts_aft.shape[1])
+
+    return chrom, rep, ts_aft, locs, aft_windows, gens, freq_scale
+
+
+def prefetch_inputs(npz_paths, mmap, io_threads, config):
+    """
+    Yields loaded inputs in order while the next ones are loaded on a thread pool.
+
+    Up to io_threads inputs are loaded ahead of the one being yielded, so at most io_threads + 1 inputs
+    are held in memory at once.
+
+    Args:
+        npz_paths (list[str]): NPZ files to load.
+        mmap (bool): Whether to memory-map inputs instead of decoding them, see load_input.
+        io_threads (int): Number of inputs to load concurrently.
+        config (dict): YAML config, see get_sampled_gens.
+
+    Yields:
+        tuple(str, tuple): NPZ path and the result of load_input for it.
+    """
+    path_iter = iter(npz_paths)
+    with ThreadPoolExecutor(max_workers=io_threads) as pool:
+        pending = deque(
+            (npz_path, pool.submit(load_input, npz_path, mmap, config))
+            for npz_path in islice(path_iter, io_threads)
+        )
+
+        while pending:
+            npz_path, loaded = pending.popleft()
+            next_path = next(path_iter, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(load_input, next_path, mmap, config)))
+            # neither the future nor a local may keep the input once it is yielded, the caller frees it when done
+            inputs = [loaded.result()]
+            del loaded
+            yield npz_path, inputs.pop()
+
+
+def run_aft_windows(ts_aft, locs, chrom, model, batch_size=None):
     """
     Iterates through windows of MAF time-series matrix and predicts using NN.
 
@@ -46,57 +284,202 @@ def run_aft_windows(ts_aft, locs, chrom, model):
         samp_sizes (list[int]): Number of chromosomes sampled at each timepoint.
         win_size (int): Number of SNPs to use for each prediction. Needs to match how NN was trained.
         model (Keras.model): Keras model to use for prediction.
+        batch_size (int, optional): Batch size passed to model.predict. Defaults to the Keras default.
 
     Returns:
-        dict: Prediction values in the form of dict[snps[center]]
-        np.arr: the central-most window, either based on mutation type or closest to half size of chrom.
+        tuple: chrom, then arrays of window centers, left edges, right edges and (windows, classes) prediction scores.
+    """
+    left_edges = locs[:, 0]
+    right_edges = locs[:, -1]
+    centers = locs[:, 25]
+    if len(ts_aft):
+        probs = model.predict(ts_aft, batch_size=batch_size)
+    else:
+        # an input with no windows (fewer SNPs than a window), Keras can't predict on an empty batch
+        probs = np.empty((0, 2), dtype=np.float32)
+
+    return chrom, centers, left_edges, right_edges, probs
+
+
+def prefetch_chunks(ts_aft, locs, chunk_size, depth=2, freq_scale=None):
+    """
+    Yields contiguous chunks of windows, the next chunks are read on a background thread
+    while the current one is being predicted on.
+
+    Args:
+        ts_aft (np.arr): Allele frequency windows, shape (windows, timepoints, win_size). Can be a memmap or view.
+        locs (np.arr): SNP positions of each window, shape (windows, win_size).
+        chunk_size (int): Number of windows per chunk.
+        depth (int, optional): Number of chunks to read ahead. Defaults to 2.
+        freq_scale (float, optional): Scale of quantized frequencies, see get_freq_scale. Defaults to None.
+
+    Yields:
+        tuple(np.arr, np.arr): float32 ts_aft and locs for the next chunk of windows.
     """
-    left_edges = list(locs[:, 0])
-    right_edges = list(locs[:, -1])
-    centers = list(locs[:, 25])
-    probs = model.predict(ts_aft)
+    chunk_queue = queue.Queue(maxsize=depth)
+
+    def load_chunks():
+        try:
+            for start in range(0, len(locs), chunk_size):
+                chunk_queue.put(
+                    (
+                        dequantize_freqs(ts_aft[start : start + chunk_size], freq_scale),
+                        np.array(locs[start : start + chunk_size]),
+                    )
+                )
+        except Exception as err:
+            chunk_queue.put(err)
+            return
+        chunk_queue.put(None)
+
+    loader = threading.Thread(target=load_chunks, daemon=True)
+    loader.start()
+    while True:
+        chunk = chunk_queue.get()
+        if chunk is None:
+            break
+        if isinstance(chunk, Exception):
+            raise chunk
+        yield chunk
+    loader.join()
+
+
+def run_aft_windows_chunked(ts_aft, locs, chrom, models, chunk_size, batch_size=None, freq_scale=None):
+    """
+    Predicts on windows in fixed-size chunks so that peak memory depends on chunk_size rather than chromosome length.
+    Each chunk is read once and shared by all models.
+
+    Args:
+        models (dict[str, Keras.model]): Models to predict with, keyed by label.
+
+    Yields:
+        dict[str, tuple]: Results for each chunk and model in the same form as run_aft_windows.
+    """
+    if len(locs) == 0:
+        # a single empty chunk, so the outputs are still written with their headers
+        yield {label: run_aft_windows(ts_aft, locs, chrom, model, batch_size) for label, model in models.items()}
+        return
+
+    for aft_chunk, locs_chunk in prefetch_chunks(ts_aft, locs, chunk_size, freq_scale=freq_scale):
+        yield {
+            label: run_aft_windows(aft_chunk, locs_chunk, chrom, model, batch_size)
+            for label, model in models.items()
+        }
+
 
-    results_list = zip(cycle([chrom]), centers, left_edges, right_edges, probs)
+def run_fit_windows(ts_aft, locs, chrom, gens, freq_scale=None):
+    """
+    Calculates FIT on the central SNP of every window at once.
+
+    Args:
+        ts_aft (np.arr): Allele frequency windows, shape (windows, timepoints, win_size).
+        locs (np.arr): SNP positions of each window, shape (windows, win_size).
+        chrom (str): Chromosome the windows are from.
+        gens (np.arr): Generation sampled at each timepoint, shape (timepoints,) or (windows, timepoints).
+        freq_scale (float, optional): Scale of quantized frequencies, see get_freq_scale. Defaults to None.
+
+    Returns:
+        list[tup(chrom, pos, pval)]: P values from FIT.
+    """
+    center_freqs = dequantize_freqs(ts_aft[:, :, 25], freq_scale, dtype=np.float64)
+    _, pvals = fit_batch(center_freqs, gens)  # tval, pval
+    results_list = list(zip(cycle([chrom]), locs[:, 25], pvals))
 
     return results_list
 
 
-def run_fit_windows(ts_aft, locs, chrom):
+def parse_model_args(model_args):
     """
-    Iterates through windows of MAF time-series matrix and predicts using NN.
+    Splits --aft-model entries into labels and paths.
 
     Args:
-        snps (list[tup(chrom, pos,  mut)]): Tuples of information for each SNP. Contains mut only if benchmarking == True.
-        genos (allel.GenotypeArray): Genotypes of all samples. 
-        samp_sizes (list[int]): Number of chromosomes sampled at each timepoint.
-        win_size (int): Number of SNPs to use for each prediction. Needs to match how NN was trained.
-        gens (list[int]): List of generations that were sampled.
+        model_args (list[str]): Entries given either as a path or as label=path. The label defaults to the model directory name.
 
     Returns:
-        dict: P values from FIT.
+        dict[str, str]: Model paths keyed by label.
     """
-    gens = [i * 10 for i in range(7)]
+    model_paths = {}
+    for model_arg in model_args:
+        label, _, model_path = model_arg.rpartition("=")
+        if not label:
+            label = os.path.basename(os.path.normpath(model_path))
+        model_paths[label] = model_path
 
-    results_list = []
-    for snp in tqdm(range(len(locs)), desc="Calculating FIT values"):
-        results_list.append(
-            (chrom, locs[snp, 25], fit(list(ts_aft[snp, :, 25]), gens)[1])
-        )  # tval, pval
+    return model_paths
 
-    return results_list
 
+class OnnxModel:
+    """
+    Runs a model exported by export_onnx.py with onnxruntime, behind the same predict interface as a Keras model.
 
-def load_nn(model_path, summary=False):
+    Args:
+        model_path (str): Path to .onnx model.
+        intra_op_threads (int, optional): Threads used within each operator. Defaults to onnxruntime's choice.
+    """
+
+    def __init__(self, model_path, intra_op_threads=None):
+        import onnxruntime as ort
+
+        sess_options = ort.SessionOptions()
+        if intra_op_threads is not None:
+            sess_options.intra_op_num_threads = intra_op_threads
+        sess_options.inter_op_num_threads = 1  # the network is a single chain of ops
+        self.session = ort.InferenceSession(
+            model_path, sess_options=sess_options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+        # symbolic dims (the batch dim) as None, like a Keras model's input_shape
+        self.input_shape = tuple(
+            dim if isinstance(dim, int) else None for dim in self.session.get_inputs()[0].shape
+        )
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """Predicts on x in batches of batch_size windows, all at once if not given."""
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        batch_size = batch_size or max(len(x), 1)
+        probs = [
+            self.session.run(None, {self.input_name: x[start : start + batch_size]})[0]
+            for start in range(0, len(x), batch_size)
+        ]
+
+        return np.concatenate(probs) if probs else np.empty((0, 2), dtype=np.float32)
+
+    def summary(self):
+        return "\n".join(f"{i.name}: {i.shape} {i.type}" for i in self.session.get_inputs())
+
+
+def resolve_model_path(model_path, backend):
+    """Gets the path the backend loads a model from, <model_path>.onnx for onnx unless given directly."""
+    if backend == "onnx" and not model_path.endswith(".onnx"):
+        return f"{model_path.rstrip('/')}.onnx"
+
+    return model_path
+
+
+def load_nn(model_path, summary=False, backend="keras", intra_op_threads=None):
     """
     Loads the trained Keras network.
 
     Args:
         model_path (str): Path to Keras model.
         summary (bool, optional): Whether to print out model summary or not. Defaults to False.
+        backend (str, optional): "keras" to load the SavedModel with TensorFlow, or "onnx" to run the model
+            exported by export_onnx.py (<model_path>.onnx) with onnxruntime. Defaults to "keras".
+        intra_op_threads (int, optional): Threads onnxruntime uses within each operator. Defaults to None.
 
     Returns:
-        Keras.model: Trained Keras model to use for prediction.
+        Keras.model: Trained Keras model to use for prediction, or an OnnxModel with the same predict method.
     """
+    if backend == "onnx":
+        model = OnnxModel(resolve_model_path(model_path, backend), intra_op_threads)
+        if summary:
+            print(model.summary())
+
+        return model
+
+    # imported here so FIT-only runs don't pay for TensorFlow's startup time and memory
+    from tensorflow.keras.models import load_model
+
     model = load_model(model_path)
     if summary:
         print(model.summary())
@@ -112,10 +495,8 @@ def write_fit(fit_list, outfile):
         fit_dict (dict): FIT p values and SNP information.
         outfile (str): File to write results to.
     """
-    chrom, bps, pval = zip(*fit_list)
-    inv_pval = [1 - i for i in pval]
-
-    predictions = pd.DataFrame({"Chrom": chrom, "BP": bps, "Inv_pval": inv_pval})
+    predictions = pd.DataFrame(fit_list, columns=["Chrom", "BP", "Inv_pval"])
+    predictions["Inv_pval"] = 1 - predictions["Inv_pval"]
     # predictions = predictions[predictions["Inv_pval"] > 0.9]
 
     predictions.sort_values(["Chrom", "BP"], inplace=True)
@@ -124,20 +505,28 @@ def write_fit(fit_list, outfile):
     )
 
 
-def write_preds(results_list, outfile, benchmark):
+def write_preds(results, outfile, benchmark, append=False, parquet_writer=None):
     """
     Writes NN predictions to file.
 
     Args:
-        results_dict (dict): SNP NN prediction scores and window edges.
+        results (tuple): SNP NN prediction scores and window edges, as returned by run_aft_windows.
         outfile (str): File to write results to.
+        append (bool, optional): Append to outfile without a header, used when writing chunk by chunk. Defaults to False.
+        parquet_writer (pq.ParquetWriter, optional): Also write the predictions to this Parquet file as a row group,
+            see pred_table.py. Defaults to None.
     """
     lab_dict = {0: "Neut", 1: "Soft"}
-    chrom, centers, left_edges, right_edges, probs = zip(*results_list)
+    chrom, centers, left_edges, right_edges, probs = results
+
+    if parquet_writer is not None:
+        from pred_table import preds_to_table
+
+        parquet_writer.write_table(preds_to_table(results))
 
-    neut_scores = [i[0] for i in probs]
-    soft_scores = [i[1] for i in probs]
-    classes = [lab_dict[np.argmax(i)] for i in probs]
+    neut_scores = probs[:, 0]
+    soft_scores = probs[:, 1]
+    classes = np.array([lab_dict[0], lab_dict[1]])[np.argmax(probs, axis=1)]
 
     predictions = pd.DataFrame(
         {
@@ -155,10 +544,32 @@ def write_preds(results_list, outfile, benchmark):
 
     predictions.sort_values(["Chrom", "BP"], inplace=True)
 
-    predictions.to_csv(outfile, header=True, index=False, sep="\t", float_format="%.3f")
+    mode = "a" if append else "w"
+    predictions.to_csv(
+        outfile,
+        mode=mode,
+        header=not append,
+        index=False,
+        sep="\t",
+        float_format="%.3f",
+    )
 
     bed_df = predictions[["Chrom", "Win_Start", "Win_End", "BP"]]
-    bed_df.to_csv(outfile.replace(".csv", ".bed"), header=False, index=False, sep="\t")
+    bed_df.to_csv(
+        outfile.replace(".csv", ".bed"), mode=mode, header=False, index=False, sep="\t"
+    )
+
+
+def get_aft_outfiles(outdir, chrom, rep, parquet):
+    """Paths of the AFT output files for an input, keyed by their name in the prediction cache."""
+    outfiles = {
+        "aft_preds.csv": f"{outdir}/aft_{chrom}_{rep}_preds.csv",
+        "aft_preds.bed": f"{outdir}/aft_{chrom}_{rep}_preds.bed",
+    }
+    if parquet:
+        outfiles["aft_preds.parquet"] = f"{outdir}/aft_{chrom}_{rep}_preds.parquet"
+
+    return outfiles
 
 
 def add_file_label(filename, label):
@@ -176,7 +587,9 @@ def parse_ua():
         "-i",
         "--input-file",
         dest="input_file",
-        help="NPZ file with allele frequencies already processed in proper shape.",
+        action="append",
+        help="NPZ file with allele frequencies already processed in proper shape. Can also be a directory of NPZ files or a quoted glob pattern, \
+            and can be given multiple times to run a whole genome in one process with the models loaded once.",
         required=True,
     )
     uap.add_argument(
@@ -198,8 +611,75 @@ def parse_ua():
     uap.add_argument(
         "--aft-model",
         dest="aft_model",
-        help="Path to Keras2-style saved model to load for aft prediction.",
-        required=True,
+        action="append",
+        help="Path to Keras2-style saved model to load for aft prediction. Can be given multiple times, the input is loaded once and scored against every model. \
+            With more than one model each model's predictions are written to <out-dir>/<label>, give models as label=path to choose the label, \
+            otherwise the model directory name is used. Required unless --fit-only is used.",
+        required=False,
+    )
+    uap.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["keras", "onnx"],
+        default="keras",
+        help="Run the models with Keras, or with onnxruntime using the <model>.onnx files written by export_onnx.py, \
+            which avoids TensorFlow's startup time and thread pools on CPU nodes. Defaults to keras.",
+        required=False,
+    )
+    uap.add_argument(
+        "--intra-op-threads",
+        dest="intra_op_threads",
+        type=int,
+        help="Number of threads onnxruntime uses within each operator, usually the number of cores requested. \
+            Defaults to onnxruntime's choice.",
+        required=False,
+    )
+    uap.add_argument(
+        "--cache-dir",
+        dest="cache_dir",
+        help="Directory to cache outputs in, keyed by fingerprints of the model weights and the arrays in each input. \
+            Inputs whose outputs are already cached for every model are copied from the cache instead of being scored, \
+            models are only loaded if some input needs them.",
+        required=False,
+    )
+    uap.add_argument(
+        "--fit-only",
+        dest="fit_only",
+        action="store_true",
+        help="Only calculate FIT p-values. No model is loaded and TensorFlow is never imported, \
+            inputs are memory-mapped so many files can be run in one process with a small footprint.",
+        required=False,
+    )
+    uap.add_argument(
+        "--parquet",
+        dest="parquet",
+        action="store_true",
+        help="Also write predictions to aft_<chrom>_<rep>_preds.parquet with typed columns for faster downstream reads, \
+            see read_preds in pred_table.py. Requires pyarrow.",
+        required=False,
+    )
+    uap.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        type=int,
+        help="Memory-map the input and predict on this many windows at a time, appending results to the output as they finish. \
+            Peak memory then depends on the chunk size instead of the chromosome length. By default all windows are predicted on at once.",
+        required=False,
+    )
+    uap.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        type=int,
+        help="Batch size for model prediction. Defaults to the Keras default.",
+        required=False,
+    )
+    uap.add_argument(
+        "--io-threads",
+        dest="io_threads",
+        type=int,
+        default=2,
+        help="Number of upcoming inputs to load in the background while predicting on the current one, so up to this many plus one inputs are held in memory at once. Defaults to 2.",
+        required=False,
     )
     subparsers = uap.add_subparsers(dest="config_format")
     subparsers.required = True
@@ -207,10 +687,15 @@ def parse_ua():
     yaml_parser.add_argument(
         metavar="YAML CONFIG",
         dest="yaml_file",
-        help="YAML config file with all cli options defined.",
+        help="YAML config file with all cli options defined. Sampled generations for FIT are read from 'gens sampled' \
+            or 'years sampled' and 'gen time' if the NPZ inputs don't store them.",
     )
 
-    return uap.parse_args()
+    ua = uap.parse_args()
+    if not ua.aft_model and not ua.fit_only:
+        uap.error("--aft-model is required unless --fit-only is used")
+
+    return ua
 
 
 def read_config(yaml_file):
@@ -222,32 +707,148 @@ def read_config(yaml_file):
 
 
 def main(ua):
-    outdir, aft_model = (
-        ua.outdir,
-        load_nn(ua.aft_model),
-    )
-
-    try:
-        if not os.path.exists(outdir):
-            os.makedirs(outdir)
-    except:
-        #running in high-parallel sometimes it errors when trying to check/create simultaneously
-        pass
-
-    # Load in everything
-    logger.info(f"Loading data from {ua.input_file}")
-    chrom, rep = parse_npz_name(ua.input_file)
-    ts_aft, locs = load_npz(ua.input_file)
-
-    # aft
-    logger.info("Predicting with AFT")
-    aft_predictions = run_aft_windows(ts_aft, locs, chrom, aft_model)
-    write_preds(aft_predictions, f"{outdir}/aft_{chrom}_{rep}_preds.csv", ua.benchmark)
-    logger.info(f"Done, results written to {outdir}/aft_{chrom}_{rep}_preds.csv")
-
-    # FIT
-    fit_predictions = run_fit_windows(ts_aft, locs, chrom)
-    write_fit(fit_predictions, f"{outdir}/fit_{chrom}_{rep}_preds.csv")
+    config = read_config(ua.yaml_file)
+    model_paths = {} if ua.fit_only else parse_model_args(ua.aft_model)
+
+    if len(model_paths) <= 1:
+        model_outdirs = {label: ua.outdir for label in model_paths}
+    else:
+        model_outdirs = {label: os.path.join(ua.outdir, label) for label in model_paths}
+
+    # FIT is written alongside each model's predictions, or straight to the outdir without models
+    fit_outdirs = list(model_outdirs.values()) or [ua.outdir]
+    for outdir in fit_outdirs:
+        try:
+            if not os.path.exists(outdir):
+                os.makedirs(outdir)
+        except:
+            #running in high-parallel sometimes it errors when trying to check/create simultaneously
+            pass
+
+    if ua.parquet:
+        from pred_table import open_preds_writer
+
+    npz_paths = expand_inputs(ua.input_file)
+    if not npz_paths:
+        logger.error(f"No NPZ inputs found in {ua.input_file}")
+        return
+
+    # models still to run on each input and whether it still needs FIT, after taking what's cached
+    pending_models = {npz_path: list(model_paths) for npz_path in npz_paths}
+    pending_fit = {npz_path: True for npz_path in npz_paths}
+    if ua.cache_dir:
+        from pred_cache import PredictionCache
+
+        pred_cache = PredictionCache(ua.cache_dir)
+        cache_keys = {}
+        # gens can come from the config instead of the input, so they're part of the FIT key
+        gens_config = {key: config.get(key) for key in ["gens sampled", "years sampled", "gen time"]}
+        for npz_path in npz_paths:
+            chrom, rep = parse_npz_name(npz_path)
+            input_fingerprint = pred_cache.fingerprint_input(npz_path)
+            for label, model_path in model_paths.items():
+                model_fingerprint = pred_cache.fingerprint_model(resolve_model_path(model_path, ua.backend))
+                cache_keys[npz_path, label] = pred_cache.make_key(
+                    "aft", model_fingerprint, input_fingerprint, chrom, rep
+                )
+                if pred_cache.restore(
+                    cache_keys[npz_path, label], get_aft_outfiles(model_outdirs[label], chrom, rep, ua.parquet)
+                ):
+                    pending_models[npz_path].remove(label)
+
+            cache_keys[npz_path, "fit"] = pred_cache.make_key("fit", input_fingerprint, chrom, rep, gens_config)
+            fit_outfiles = [f"{outdir}/fit_{chrom}_{rep}_preds.csv" for outdir in fit_outdirs]
+            if pred_cache.restore(cache_keys[npz_path, "fit"], {"fit_preds.csv": fit_outfiles[0]}):
+                for fit_outfile in fit_outfiles[1:]:
+                    shutil.copyfile(fit_outfiles[0], fit_outfile)
+                pending_fit[npz_path] = False
+
+    npz_paths = [npz_path for npz_path in npz_paths if pending_models[npz_path] or pending_fit[npz_path]]
+    needed_labels = {label for npz_path in npz_paths for label in pending_models[npz_path]}
+    aft_models = {
+        label: load_nn(model_path, backend=ua.backend, intra_op_threads=ua.intra_op_threads)
+        for label, model_path in model_paths.items()
+        if label in needed_labels
+    }
+
+    chunked = ua.chunk_size is not None
+    # FIT only reads the central SNP of each window, so there's no need to decode whole windows
+    mmap_inputs = chunked or not aft_models
+    total_windows = 0
+    start_time = time.time()
+    for npz_path, (chrom, rep, ts_aft, locs, aft_windows, gens, freq_scale) in prefetch_inputs(
+        npz_paths, mmap_inputs, ua.io_threads, config
+    ):
+        input_start_time = time.time()
+        input_models = {label: aft_models[label] for label in pending_models[npz_path]}
+
+        # aft, skipped entirely when running FIT only
+        if input_models:
+            logger.info(f"Predicting on {npz_path} with AFT using {len(input_models)} model(s)")
+        parquet_writers = {
+            label: open_preds_writer(f"{model_outdirs[label]}/aft_{chrom}_{rep}_preds.parquet")
+            for label in input_models
+            if ua.parquet
+        }
+        if chunked and input_models:
+            for chunk_idx, chunk_predictions in enumerate(
+                run_aft_windows_chunked(
+                    ts_aft, locs, chrom, input_models, ua.chunk_size, ua.batch_size, freq_scale
+                )
+            ):
+                for label, aft_predictions in chunk_predictions.items():
+                    write_preds(
+                        aft_predictions,
+                        f"{model_outdirs[label]}/aft_{chrom}_{rep}_preds.csv",
+                        ua.benchmark,
+                        append=chunk_idx > 0,
+                        parquet_writer=parquet_writers.get(label),
+                    )
+        else:
+            # the windows were decoded once on load so every model predicts on the same array
+            for label, aft_model in input_models.items():
+                aft_predictions = run_aft_windows(
+                    aft_windows, locs, chrom, aft_model, ua.batch_size
+                )
+                write_preds(
+                    aft_predictions,
+                    f"{model_outdirs[label]}/aft_{chrom}_{rep}_preds.csv",
+                    ua.benchmark,
+                    parquet_writer=parquet_writers.get(label),
+                )
+            del aft_windows
+        for parquet_writer in parquet_writers.values():
+            parquet_writer.close()
+        for label in input_models:
+            logger.info(f"Done, results written to {model_outdirs[label]}/aft_{chrom}_{rep}_preds.csv")
+            if ua.cache_dir:
+                pred_cache.store(
+                    cache_keys[npz_path, label], get_aft_outfiles(model_outdirs[label], chrom, rep, ua.parquet)
+                )
+
+        # FIT doesn't depend on the model, so it's only calculated once
+        if pending_fit[npz_path]:
+            fit_predictions = run_fit_windows(ts_aft, locs, chrom, gens, freq_scale)
+            for outdir in fit_outdirs:
+                write_fit(fit_predictions, f"{outdir}/fit_{chrom}_{rep}_preds.csv")
+            if ua.cache_dir:
+                pred_cache.store(
+                    cache_keys[npz_path, "fit"], {"fit_preds.csv": f"{fit_outdirs[0]}/fit_{chrom}_{rep}_preds.csv"}
+                )
+
+        input_time = time.time() - input_start_time
+        total_windows += len(locs)
+        logger.info(
+            f"{npz_path}: {len(locs)} windows in {input_time:.1f}s ({len(locs) / input_time:.1f} windows/sec)"
+        )
+
+    total_time = time.time() - start_time
+    logger.info(
+        f"Scored {total_windows} windows from {len(npz_paths)} input(s) with {len(aft_models)} model(s) "
+        f"in {total_time:.1f}s ({total_windows / max(total_time, 1e-9):.1f} windows/sec)"
+    )
+    if ua.cache_dir:
+        pred_cache.log_stats()
 
 
 if __name__ == "__main__":
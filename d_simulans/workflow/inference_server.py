@@ -0,0 +1,517 @@
+"""
+Long-running local inference service that keeps AFT and HFT models loaded, so repeated detection requests
+don't each pay for importing TensorFlow and loading the models.
+
+The server listens on a Unix socket or a localhost port:
+    POST /detect           JSON {"inputs": [npz paths], "outdir": dir, "models": [labels], "fit": bool},
+                           writes the same outputs find_sweeps_npz.py would and returns the files written.
+    POST /predict?model=X  .npy (windows, timepoints, win_size) array, returns .npy (windows, classes) scores.
+    GET /status            loaded models and batching statistics.
+Concurrent requests for the same model are micro-batched into single predict calls.
+
+usage:
+    python inference_server.py serve --socket ts.sock --aft-model aft=<model> --hft-model hft=<model>
+    python inference_server.py detect --socket ts.sock -i aftInputsVelocity -o out
+    python inference_server.py predict --socket ts.sock --model hft --windows hft_windows.npy -o scores.npy
+"""
+
+import argparse as ap
+import http.client
+import io
+import json
+import logging
+import os
+import queue
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+import numpy as np
+
+from find_sweeps_npz import (
+    dequantize_freqs,
+    expand_inputs,
+    get_freq_scale,
+    load_input,
+    load_nn,
+    load_npz,
+    parse_model_args,
+    read_config,
+    run_aft_windows_chunked,
+    run_fit_windows,
+    write_fit,
+    write_preds,
+)
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+
+logging.basicConfig()
+logger = logging.getLogger("timesweeper")
+logger.setLevel("INFO")
+
+
+class MicroBatcher:
+    """
+    Runs one model on a background thread, merging requests that arrive close together into single predict calls.
+    Has the same predict method as a Keras model so it can be passed anywhere find_sweeps_npz.py takes one.
+
+    Args:
+        model (Keras.model): Loaded model.
+        max_batch_windows (int): Stop adding requests to a predict call once it has this many windows.
+        max_wait (float): Seconds to wait for more requests after the first one arrives.
+        batch_size (int, optional): Batch size passed to model.predict. Defaults to the backend default.
+    """
+
+    def __init__(self, model, max_batch_windows, max_wait, batch_size=None):
+        self.model = model
+        self.max_batch_windows = max_batch_windows
+        self.max_wait = max_wait
+        self.batch_size = batch_size
+        self.requests = queue.Queue()
+        self.num_calls = 0
+        self.num_requests = 0
+        self.num_windows = 0
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def check_windows(self, x):
+        """Raises ValueError unless x is a batch of windows the model takes, None dims of its input shape match any size."""
+        window_shape = tuple(self.model.input_shape[1:])
+        if x.ndim != 1 + len(window_shape) or any(
+            dim is not None and size != dim for size, dim in zip(x.shape[1:], window_shape)
+        ):
+            raise ValueError(f"windows of shape {x.shape} don't match the model input shape {self.model.input_shape}")
+
+    def predict(self, x, batch_size=None, verbose=0):
+        """
+        Queues windows for prediction and blocks until their scores are ready.
+
+        Windows are checked before they are queued, as one request that doesn't fit the model would otherwise
+        fail every request merged into the same predict call.
+        """
+        x = np.ascontiguousarray(x, dtype=np.float32)
+        self.check_windows(x)
+        future = Future()
+        self.requests.put((x, future))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        num_windows = len(batch[0][0])
+        deadline = time.monotonic() + self.max_wait
+        while num_windows < self.max_batch_windows:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            num_windows += len(request[0])
+
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                probs = self.model.predict(np.concatenate([windows for windows, _ in batch]), batch_size=self.batch_size)
+            except Exception as err:
+                for _, future in batch:
+                    future.set_exception(err)
+                continue
+
+            start = 0
+            for windows, future in batch:
+                future.set_result(probs[start : start + len(windows)])
+                start += len(windows)
+            self.num_calls += 1
+            self.num_requests += len(batch)
+            self.num_windows += start
+
+    def stats(self):
+        return {
+            "predict_calls": self.num_calls,
+            "requests": self.num_requests,
+            "windows": self.num_windows,
+            "requests_per_call": self.num_requests / self.num_calls if self.num_calls else 0,
+        }
+
+
+def detect_inputs(npz_paths, outdir, batchers, config, chunk_size, fit=True):
+    """
+    Predicts on NPZ inputs and writes AFT and FIT outputs the same way find_sweeps_npz.py does.
+
+    Args:
+        npz_paths (list[str]): NPZ inputs.
+        outdir (str): Directory to write to, each model gets its own subdirectory when there's more than one.
+        batchers (dict[str, MicroBatcher]): AFT models to predict with, keyed by label.
+        config (dict): YAML config, see get_sampled_gens.
+        chunk_size (int): Windows sent per predict request.
+        fit (bool, optional): Whether to calculate FIT too. Defaults to True.
+
+    Returns:
+        list[str]: Files written.
+    """
+    if len(batchers) <= 1:
+        model_outdirs = {label: outdir for label in batchers}
+    else:
+        model_outdirs = {label: os.path.join(outdir, label) for label in batchers}
+    for model_outdir in list(model_outdirs.values()) + [outdir]:
+        os.makedirs(model_outdir, exist_ok=True)
+
+    outfiles = []
+    for npz_path in npz_paths:
+        chrom, rep, ts_aft, locs, _, gens, freq_scale = load_input(npz_path, True, config)
+        for chunk_idx, chunk_predictions in enumerate(
+            run_aft_windows_chunked(ts_aft, locs, chrom, batchers, chunk_size, freq_scale=freq_scale)
+        ):
+            for label, aft_predictions in chunk_predictions.items():
+                write_preds(
+                    aft_predictions,
+                    f"{model_outdirs[label]}/aft_{chrom}_{rep}_preds.csv",
+                    False,
+                    append=chunk_idx > 0,
+                )
+        outfiles += [f"{model_outdir}/aft_{chrom}_{rep}_preds.csv" for model_outdir in model_outdirs.values()]
+
+        if fit:
+            fit_predictions = run_fit_windows(ts_aft, locs, chrom, gens, freq_scale)
+            for fit_outdir in list(model_outdirs.values()) or [outdir]:
+                write_fit(fit_predictions, f"{fit_outdir}/fit_{chrom}_{rep}_preds.csv")
+                outfiles.append(f"{fit_outdir}/fit_{chrom}_{rep}_preds.csv")
+
+    return outfiles
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+    def _send(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_json(self, status, obj):
+        self._send(status, json.dumps(obj).encode())
+
+    def do_GET(self):
+        if urlparse(self.path).path != "/status":
+            return self._send_json(404, {"error": f"unknown path {self.path}"})
+        self._send_json(
+            200,
+            {
+                "aft_models": self.server.aft_labels,
+                "models": {label: batcher.stats() for label, batcher in self.server.batchers.items()},
+            },
+        )
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if url.path == "/predict":
+                label = parse_qs(url.query)["model"][0]
+                windows = np.load(io.BytesIO(body))
+                probs = self.server.batchers[label].predict(windows)
+                probs_buf = io.BytesIO()
+                np.save(probs_buf, probs)
+                self._send(200, probs_buf.getvalue(), "application/octet-stream")
+            elif url.path == "/detect":
+                request = json.loads(body)
+                labels = request.get("models") or self.server.aft_labels
+                outfiles = detect_inputs(
+                    request["inputs"],
+                    request["outdir"],
+                    {label: self.server.batchers[label] for label in labels},
+                    self.server.config,
+                    self.server.chunk_size,
+                    request.get("fit", True),
+                )
+                self._send_json(200, {"outfiles": outfiles})
+            else:
+                self._send_json(404, {"error": f"unknown path {self.path}"})
+        except KeyError as err:
+            self._send_json(400, {"error": f"missing or unknown {err}"})
+        except ValueError as err:
+            self._send_json(400, {"error": str(err)})
+        except Exception as err:
+            logger.exception(f"{url.path} request failed")
+            self._send_json(500, {"error": f"{type(err).__name__}: {err}"})
+
+    def log_message(self, format, *args):
+        logger.debug(format % args)
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a Unix socket for the client."""
+
+    def __init__(self, socket_path, timeout=None):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.socket_path)
+
+
+def make_server(ua):
+    if ua.socket:
+        if os.path.exists(ua.socket):
+            try:
+                UnixHTTPConnection(ua.socket).connect()
+                raise RuntimeError(f"A server is already listening on {ua.socket}")
+            except ConnectionRefusedError:
+                os.remove(ua.socket)  # left behind by a server that didn't shut down cleanly
+        return ThreadingUnixHTTPServer(ua.socket, InferenceHandler)
+
+    # only ever bound to localhost, there's no authentication
+    return ThreadingHTTPServer(("127.0.0.1", ua.port), InferenceHandler)
+
+
+def serve(ua):
+    aft_model_paths = parse_model_args(ua.aft_model or [])
+    hft_model_paths = parse_model_args(ua.hft_model or [])
+    if set(aft_model_paths) & set(hft_model_paths):
+        raise ValueError("AFT and HFT models need different labels, give them as label=path")
+
+    server = make_server(ua)
+    server.batchers = {
+        label: MicroBatcher(
+            load_nn(model_path, backend=ua.backend, intra_op_threads=ua.intra_op_threads),
+            ua.max_batch_windows,
+            ua.max_wait_ms / 1000,
+            ua.batch_size,
+        )
+        for label, model_path in {**aft_model_paths, **hft_model_paths}.items()
+    }
+    server.aft_labels = list(aft_model_paths)
+    server.config = read_config(ua.yaml_file) if ua.yaml_file else {}
+    server.chunk_size = ua.chunk_size
+
+    logger.info(f"Serving {', '.join(server.batchers)} on {ua.socket or f'127.0.0.1:{ua.port}'}")
+    # SLURM stops jobs with SIGTERM, exit through the finally below so the socket is removed
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if ua.socket and os.path.exists(ua.socket):
+            os.remove(ua.socket)
+
+
+def send_request(ua, method, path, body=None):
+    """Sends one request to the server on a new connection, raising if it fails."""
+    conn = UnixHTTPConnection(ua.socket) if ua.socket else http.client.HTTPConnection("127.0.0.1", ua.port)
+    try:
+        conn.request(method, path, body=body)
+        response = conn.getresponse()
+        response_body = response.read()
+    finally:
+        conn.close()
+    if response.status != 200:
+        raise RuntimeError(f"{method} {path} failed ({response.status}): {json.loads(response_body)['error']}")
+
+    return response_body
+
+
+def detect(ua):
+    npz_paths = expand_inputs(ua.input_file)
+    if not npz_paths:
+        logger.error(f"No NPZ inputs found in {ua.input_file}")
+        sys.exit(1)
+
+    def detect_one(npz_path):
+        request = {
+            "inputs": [os.path.abspath(npz_path)],
+            "outdir": os.path.abspath(ua.outdir),
+            "models": ua.models,
+            "fit": not ua.no_fit,
+        }
+        return json.loads(send_request(ua, "POST", "/detect", json.dumps(request).encode()))["outfiles"]
+
+    # inputs are sent as separate concurrent requests so the server can batch their windows together
+    with ThreadPoolExecutor(max_workers=ua.parallel) as pool:
+        for npz_path, outfiles in zip(npz_paths, pool.map(detect_one, npz_paths)):
+            logger.info(f"{npz_path}: wrote {', '.join(outfiles)}")
+
+
+def predict(ua):
+    if ua.windows.endswith(".npz"):
+        ts_aft, _ = load_npz(ua.windows, mmap=True)
+        windows = dequantize_freqs(ts_aft, get_freq_scale(ua.windows))
+    else:
+        windows = np.load(ua.windows)
+    windows_buf = io.BytesIO()
+    np.save(windows_buf, windows)
+
+    probs = np.load(io.BytesIO(send_request(ua, "POST", f"/predict?{urlencode({'model': ua.model})}", windows_buf.getvalue())))
+    np.save(ua.outfile, probs)
+    logger.info(f"Scores for {len(probs)} windows written to {ua.outfile}")
+
+
+def status(ua):
+    print(json.dumps(json.loads(send_request(ua, "GET", "/status")), indent=2))
+
+
+def parse_ua():
+    uap = ap.ArgumentParser(
+        description="Local inference server that keeps Timesweeper models loaded between detection requests, and its client."
+    )
+    connection_parser = ap.ArgumentParser(add_help=False)
+    connection_args = connection_parser.add_mutually_exclusive_group()
+    connection_args.add_argument(
+        "--socket",
+        dest="socket",
+        help="Unix socket the server listens on.",
+    )
+    connection_args.add_argument(
+        "--port",
+        dest="port",
+        type=int,
+        default=8765,
+        help="Localhost port the server listens on if no socket is given. Defaults to 8765.",
+    )
+    subparsers = uap.add_subparsers(dest="command")
+    subparsers.required = True
+
+    serve_parser = subparsers.add_parser("serve", parents=[connection_parser], help="Load models and serve requests.")
+    serve_parser.add_argument(
+        "--aft-model",
+        dest="aft_model",
+        action="append",
+        help="AFT model to keep loaded, as label=path or path. Can be given multiple times.",
+    )
+    serve_parser.add_argument(
+        "--hft-model",
+        dest="hft_model",
+        action="append",
+        help="HFT model to keep loaded, as label=path or path. Only used by predict requests. Can be given multiple times.",
+    )
+    serve_parser.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["keras", "onnx"],
+        default="keras",
+        help="Inference backend, see find_sweeps_npz.py. Defaults to keras.",
+    )
+    serve_parser.add_argument(
+        "--intra-op-threads",
+        dest="intra_op_threads",
+        type=int,
+        help="Number of threads onnxruntime uses within each operator.",
+    )
+    serve_parser.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        type=int,
+        help="Batch size for model prediction. Defaults to the backend default.",
+    )
+    serve_parser.add_argument(
+        "--max-batch-windows",
+        dest="max_batch_windows",
+        type=int,
+        default=65536,
+        help="Most windows to merge from concurrent requests into one predict call. Defaults to 65536.",
+    )
+    serve_parser.add_argument(
+        "--max-wait-ms",
+        dest="max_wait_ms",
+        type=float,
+        default=5,
+        help="Milliseconds to wait for more requests to merge after one arrives. Defaults to 5.",
+    )
+    serve_parser.add_argument(
+        "--chunk-size",
+        dest="chunk_size",
+        type=int,
+        default=10000,
+        help="Windows per predict request when detecting on NPZ inputs. Defaults to 10000.",
+    )
+    serve_parser.add_argument(
+        "--yaml",
+        dest="yaml_file",
+        help="YAML config to read sampled generations for FIT from, see find_sweeps_npz.py.",
+    )
+
+    detect_parser = subparsers.add_parser("detect", parents=[connection_parser], help="Detect sweeps in NPZ inputs.")
+    detect_parser.add_argument(
+        "-i",
+        "--input-file",
+        dest="input_file",
+        action="append",
+        required=True,
+        help="NPZ file, directory of NPZ files or quoted glob pattern. Can be given multiple times.",
+    )
+    detect_parser.add_argument(
+        "-o",
+        "--out-dir",
+        dest="outdir",
+        required=True,
+        help="Directory to write output to.",
+    )
+    detect_parser.add_argument(
+        "--model",
+        dest="models",
+        action="append",
+        help="Label of a loaded AFT model to use. Can be given multiple times. Defaults to every AFT model.",
+    )
+    detect_parser.add_argument(
+        "--no-fit",
+        dest="no_fit",
+        action="store_true",
+        help="Don't calculate FIT.",
+    )
+    detect_parser.add_argument(
+        "--parallel",
+        dest="parallel",
+        type=int,
+        default=4,
+        help="Number of inputs to send at once. Defaults to 4.",
+    )
+
+    predict_parser = subparsers.add_parser("predict", parents=[connection_parser], help="Score an array of windows.")
+    predict_parser.add_argument(
+        "--model",
+        dest="model",
+        required=True,
+        help="Label of the loaded model to use.",
+    )
+    predict_parser.add_argument(
+        "--windows",
+        dest="windows",
+        required=True,
+        help=".npy file of (windows, timepoints, win_size) inputs, or an NPZ input to score every window of.",
+    )
+    predict_parser.add_argument(
+        "-o",
+        "--outfile",
+        dest="outfile",
+        required=True,
+        help=".npy file to write (windows, classes) scores to.",
+    )
+
+    subparsers.add_parser("status", parents=[connection_parser], help="Show loaded models and batching statistics.")
+
+    return uap.parse_args()
+
+
+def main(ua):
+    {"serve": serve, "detect": detect, "predict": predict, "status": status}[ua.command](ua)
+
+
+if __name__ == "__main__":
+    ua = parse_ua()
+    main(ua)
@@ -0,0 +1,243 @@
+"""
+Reports how storing input frequencies as float16 or uint8 (freqStorage in E_R_formatting_script.py) changes results
+compared to float64.
+
+Two comparisons are made:
+    - Labelled test set: accuracy, ROC AUC and average precision of the float64 test predictions in
+      d_simulans/test_predictions against predictions made on the same test set from reduced-precision inputs.
+    - E&R inputs: float64 NPZ inputs are round-tripped through each storage type in memory and the frequency error,
+      AFT score changes, class flips and FIT p-value changes are measured.
+
+uint8 stores frequencies in 1/254 steps and reserves code 255 for missing (nan) frequencies, which read back as nan
+rather than 0. The frequency error is over the frequencies present in both, missing_freq_mismatches counts any
+frequency only one of them has.
+"""
+
+import argparse as ap
+import json
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+
+from find_sweeps_npz import (
+    dequantize_freqs,
+    get_freq_scale,
+    get_sampled_gens,
+    load_nn,
+    load_npz,
+    parse_model_args,
+    parse_npz_name,
+    run_fit_windows,
+)
+
+os.environ["TF_CPP_MIN_LOG_LEVEL"] = "3"
+
+logging.basicConfig()
+logger = logging.getLogger("timesweeper")
+logger.setLevel("INFO")
+
+
+test_pred_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "test_predictions")
+
+
+def roundtrip_freqs(freqs, storage):
+    """
+    Stores freqs the way the conversion script would and reads them back the way find_sweeps_npz.py does.
+
+    Args:
+        freqs (np.arr): float64 frequencies.
+        storage (str): "float64", "float16" or "uint8".
+
+    Returns:
+        np.arr: float32 frequencies as the model would see them.
+    """
+    if storage == "uint8":
+        codes = np.rint(freqs * 254)
+        codes[np.isnan(codes)] = 255
+        return dequantize_freqs(codes.astype(np.uint8), 1 / 254)
+
+    return dequantize_freqs(freqs.astype(storage))
+
+
+def get_test_metrics(test_preds):
+    """Accuracy, ROC AUC and average precision of test predictions with true, pred and soft_scores columns."""
+    return {
+        "accuracy": metrics.accuracy_score(test_preds["true"], test_preds["pred"]),
+        "roc_auc": metrics.roc_auc_score(test_preds["true"], test_preds["soft_scores"]),
+        "avg_precision": metrics.average_precision_score(test_preds["true"], test_preds["soft_scores"]),
+    }
+
+
+def compare_test_preds(base_file, reduced_file, storage):
+    """
+    Compares test predictions from float64 and reduced-precision inputs, rows are expected to be the same samples.
+
+    Returns:
+        dict: Metrics of both and the score differences between them.
+    """
+    base_preds = pd.read_csv(base_file)
+    reduced_preds = pd.read_csv(reduced_file)
+    if len(base_preds) != len(reduced_preds) or (base_preds["true"] != reduced_preds["true"]).any():
+        raise ValueError(f"{reduced_file} doesn't have the same test samples as {base_file}")
+
+    score_diffs = np.abs(base_preds["soft_scores"] - reduced_preds["soft_scores"])
+    result = {"comparison": "test set", "input": os.path.basename(base_file), "storage": storage}
+    for name, value in get_test_metrics(base_preds).items():
+        result[f"float64_{name}"] = value
+    for name, value in get_test_metrics(reduced_preds).items():
+        result[f"{storage}_{name}"] = value
+        result[f"delta_{name}"] = value - result[f"float64_{name}"]
+    result["max_score_diff"] = score_diffs.max()
+    result["mean_score_diff"] = score_diffs.mean()
+    result["class_flip_rate"] = (base_preds["pred"] != reduced_preds["pred"]).mean()
+
+    return result
+
+
+def compare_npz(npz_path, storage, models, batch_size):
+    """
+    Round-trips a float64 NPZ input through a storage type and measures the change in inputs, AFT scores and FIT.
+
+    Returns:
+        dict: Frequency, score and p-value differences.
+    """
+    ts_aft, locs = load_npz(npz_path)
+    if ts_aft.dtype != np.float64 or get_freq_scale(npz_path) is not None:
+        raise ValueError(f"{npz_path} isn't stored as float64")
+
+    base_windows = dequantize_freqs(ts_aft)
+    reduced_windows = roundtrip_freqs(np.asarray(ts_aft), storage)
+    # every snp is the center of one window, so this covers each stored freq once
+    base_freqs, reduced_freqs = ts_aft[:, :, 25], reduced_windows[:, :, 25]
+    freq_diffs = np.abs(base_freqs - reduced_freqs)
+    result = {
+        "comparison": "npz",
+        "input": os.path.basename(npz_path),
+        "storage": storage,
+        "max_freq_diff": np.nanmax(freq_diffs, initial=0),
+        "mean_freq_diff": np.nanmean(freq_diffs),
+        "missing_freq_mismatches": int((np.isnan(base_freqs) != np.isnan(reduced_freqs)).sum()),
+    }
+
+    _, rep = parse_npz_name(npz_path)
+    gens = get_sampled_gens(npz_path, rep, {}, ts_aft.shape[1])
+    _, _, base_pvals = zip(*run_fit_windows(ts_aft, locs, "", gens))
+    _, _, reduced_pvals = zip(*run_fit_windows(reduced_windows, locs, "", gens))
+    base_pvals, reduced_pvals = np.array(base_pvals), np.array(reduced_pvals)
+    tested = ~np.isnan(base_pvals) & ~np.isnan(reduced_pvals)
+    result["max_fit_pval_diff"] = np.abs(base_pvals - reduced_pvals)[tested].max(initial=0)
+    result["fit_sig_flip_rate"] = ((base_pvals < 0.05) != (reduced_pvals < 0.05))[tested].mean()
+
+    for label, model in models.items():
+        base_probs = model.predict(base_windows, batch_size=batch_size)
+        reduced_probs = model.predict(reduced_windows, batch_size=batch_size)
+        score_diffs = np.abs(base_probs[:, 1] - reduced_probs[:, 1])
+        result[f"{label}_max_score_diff"] = score_diffs.max()
+        result[f"{label}_mean_score_diff"] = score_diffs.mean()
+        result[f"{label}_class_flip_rate"] = (base_probs.argmax(1) != reduced_probs.argmax(1)).mean()
+
+    return result
+
+
+def parse_ua():
+    uap = ap.ArgumentParser(
+        description="Reports the accuracy impact of float16 and uint8 frequency storage against float64."
+    )
+    uap.add_argument(
+        "--test-preds",
+        dest="test_preds",
+        action="append",
+        help="Reduced-precision test predictions to compare as storage=file.csv, in the same format and sample order as "
+        "the float64 predictions given by --base-test-preds. Can be given multiple times.",
+        required=False,
+    )
+    uap.add_argument(
+        "--base-test-preds",
+        dest="base_test_preds",
+        default=os.path.join(test_pred_dir, "D_simulans_Timesweeper_aft_test_predictions.csv"),
+        help="float64 test predictions. Defaults to d_simulans/test_predictions/D_simulans_Timesweeper_aft_test_predictions.csv.",
+        required=False,
+    )
+    uap.add_argument(
+        "--npz",
+        dest="npz",
+        action="append",
+        help="float64 NPZ input to round-trip through each storage type. Can be given multiple times.",
+        required=False,
+    )
+    uap.add_argument(
+        "--aft-model",
+        dest="aft_model",
+        action="append",
+        help="Model to compare scores with on the NPZ inputs, as for find_sweeps_npz.py. Without one only inputs and FIT are compared.",
+        required=False,
+    )
+    uap.add_argument(
+        "--backend",
+        dest="backend",
+        choices=["keras", "onnx"],
+        default="keras",
+        help="Inference backend, see find_sweeps_npz.py. Defaults to keras.",
+        required=False,
+    )
+    uap.add_argument(
+        "--batch-size",
+        dest="batch_size",
+        type=int,
+        help="Batch size for model prediction. Defaults to the backend default.",
+        required=False,
+    )
+    uap.add_argument(
+        "--storage",
+        dest="storage",
+        nargs="+",
+        default=["float16", "uint8"],
+        help="Storage types to compare on the NPZ inputs. Defaults to float16 uint8.",
+        required=False,
+    )
+    uap.add_argument(
+        "-o",
+        "--out-json",
+        dest="out_json",
+        help="JSON file to also write the report to.",
+        required=False,
+    )
+
+    return uap.parse_args()
+
+
+def main(ua):
+    results = []
+
+    logger.info(f"float64 test set metrics for {ua.base_test_preds}: {get_test_metrics(pd.read_csv(ua.base_test_preds))}")
+    for test_pred_arg in ua.test_preds or []:
+        storage, test_pred_file = test_pred_arg.split("=", 1)
+        results.append(compare_test_preds(ua.base_test_preds, test_pred_file, storage))
+
+    models = {}
+    if ua.aft_model:
+        models = {
+            label: load_nn(model_path, backend=ua.backend)
+            for label, model_path in parse_model_args(ua.aft_model).items()
+        }
+    for npz_path in ua.npz or []:
+        for storage in ua.storage:
+            results.append(compare_npz(npz_path, storage, models, ua.batch_size))
+
+    if not results:
+        logger.info("Nothing to compare, give --test-preds or --npz")
+        return
+
+    for comparison, comp_df in pd.DataFrame(results).groupby("comparison", sort=False):
+        print(comp_df.dropna(axis=1, how="all").to_string(index=False, float_format="{:.3g}".format))
+    if ua.out_json:
+        with open(ua.out_json, "w") as outfile:
+            json.dump(results, outfile, indent=2, default=float)
+
+
+if __name__ == "__main__":
+    ua = parse_ua()
+    main(ua)
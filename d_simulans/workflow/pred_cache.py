@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import zipfile
+
+logger = logging.getLogger("timesweeper")
+
+# Cache of find_sweeps_npz.py outputs, so reruns skip scoring when neither the model nor the input changed.
+# Entries are directories of output files named by a key hashed from the fingerprints of everything the outputs
+# depend on: model weights, the arrays in the input NPZ, the chrom/rep parsed from its name and any settings.
+
+
+class PredictionCache:
+    """
+    Stores and restores output files keyed by model and input fingerprints, counting hits and misses.
+
+    Args:
+        cache_dir (str): Directory to keep cached outputs in, created if needed.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+        self.model_fingerprints = {}
+
+    def fingerprint_model(self, model_path):
+        """Hashes every file of a SavedModel directory (or a single model file), memoized per path."""
+        if model_path not in self.model_fingerprints:
+            model_hash = hashlib.blake2b(digest_size=16)
+            if os.path.isdir(model_path):
+                model_files = sorted(
+                    os.path.join(root, f) for root, _, files in os.walk(model_path) for f in files
+                )
+            else:
+                model_files = [model_path]
+            for model_file in model_files:
+                model_hash.update(os.path.relpath(model_file, model_path).encode())
+                with open(model_file, "rb") as infile:
+                    for block in iter(lambda: infile.read(1 << 24), b""):
+                        model_hash.update(block)
+            self.model_fingerprints[model_path] = model_hash.hexdigest()
+
+        return self.model_fingerprints[model_path]
+
+    def fingerprint_input(self, npz_path):
+        """
+        Hashes the arrays stored in an NPZ.
+
+        The uncompressed .npy members are hashed rather than the file itself, so the fingerprint
+        only depends on the arrays and not on whether np.savez or np.savez_compressed wrote them.
+        """
+        input_hash = hashlib.blake2b(digest_size=16)
+        with zipfile.ZipFile(npz_path) as zf:
+            for name in sorted(zf.namelist()):
+                input_hash.update(name.encode())
+                with zf.open(name) as member:
+                    for block in iter(lambda: member.read(1 << 24), b""):
+                        input_hash.update(block)
+
+        return input_hash.hexdigest()
+
+    def make_key(self, *parts):
+        """Combines fingerprints and any settings the outputs depend on into one cache key."""
+        return hashlib.blake2b(json.dumps(parts, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def restore(self, key, outfiles):
+        """
+        Copies cached outputs to their destinations.
+
+        Args:
+            key (str): Cache key from make_key.
+            outfiles (dict[str, str]): Destination path of each cached file, by name within the entry.
+
+        Returns:
+            bool: Whether every file was cached, nothing is copied otherwise.
+        """
+        entry_dir = self._entry_dir(key)
+        if all(os.path.exists(os.path.join(entry_dir, name)) for name in outfiles):
+            for name, outfile in outfiles.items():
+                shutil.copyfile(os.path.join(entry_dir, name), outfile)
+            self.hits += 1
+            return True
+
+        self.misses += 1
+        return False
+
+    def store(self, key, outfiles):
+        """
+        Copies freshly written outputs into the cache. Files are copied to a temporary directory
+        that is renamed into place, so a killed job never leaves a partial entry. Jobs running in
+        parallel can store the same key, whichever renames first wins and the others keep its entry.
+
+        Args:
+            key (str): Cache key from make_key.
+            outfiles (dict[str, str]): Path of each output file, by name within the entry.
+        """
+        entry_dir = self._entry_dir(key)
+        if os.path.isdir(entry_dir):
+            return
+
+        os.makedirs(os.path.dirname(entry_dir), exist_ok=True)
+        tmp_dir = tempfile.mkdtemp(prefix=f"{key}.tmp", dir=os.path.dirname(entry_dir))
+        for name, outfile in outfiles.items():
+            shutil.copyfile(outfile, os.path.join(tmp_dir, name))
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another job stored the entry since the check above, renaming onto it fails as it isn't empty
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(entry_dir):
+                raise
+
+    def log_stats(self):
+        total = self.hits + self.misses
+        hit_rate = 100 * self.hits / total if total else 0
+        logger.info(f"Prediction cache: {self.hits} hits, {self.misses} misses ({hit_rate:.1f}% hit rate)")
@@ -0,0 +1,86 @@
+import os
+from glob import glob
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Columnar (Parquet) copies of the aft_*_preds.csv files written by find_sweeps_npz.py.
+# Scores are float32, chromosomes and classes are dictionary encoded and positions/window edges are int64.
+# Each chunk of predictions is written as its own row group, so reads filtered on BP or Soft_Score
+# can skip row groups using the min/max statistics Parquet keeps for every column.
+
+PRED_SCHEMA = pa.schema(
+    [
+        ("Chrom", pa.dictionary(pa.int32(), pa.string())),
+        ("BP", pa.int64()),
+        ("Class", pa.dictionary(pa.int8(), pa.string())),
+        ("Neut_Score", pa.float32()),
+        ("Soft_Score", pa.float32()),
+        ("Win_Start", pa.int64()),
+        ("Win_End", pa.int64()),
+    ]
+)
+CLASS_LABELS = ["Neut", "Soft"]
+
+
+def preds_to_table(results):
+    """
+    Builds an Arrow table directly from the prediction arrays.
+
+    Args:
+        results (tuple): chrom, centers, left_edges, right_edges and probs as returned by run_aft_windows.
+
+    Returns:
+        pa.Table: Predictions with PRED_SCHEMA.
+    """
+    chrom, centers, left_edges, right_edges, probs = results
+    num_wins = len(centers)
+
+    return pa.table(
+        {
+            "Chrom": pa.DictionaryArray.from_arrays(
+                np.zeros(num_wins, dtype=np.int32), pa.array([chrom])
+            ),
+            "BP": pa.array(np.asarray(centers, dtype=np.int64)),
+            "Class": pa.DictionaryArray.from_arrays(
+                np.argmax(probs, axis=1).astype(np.int8), pa.array(CLASS_LABELS)
+            ),
+            "Neut_Score": pa.array(np.asarray(probs[:, 0], dtype=np.float32)),
+            "Soft_Score": pa.array(np.asarray(probs[:, 1], dtype=np.float32)),
+            "Win_Start": pa.array(np.asarray(left_edges, dtype=np.int64)),
+            "Win_End": pa.array(np.asarray(right_edges, dtype=np.int64)),
+        },
+        schema=PRED_SCHEMA,
+    )
+
+
+def open_preds_writer(outfile):
+    """Opens a Parquet writer for predictions, each call to write_table on it adds a row group."""
+    return pq.ParquetWriter(outfile, PRED_SCHEMA)
+
+
+def read_preds(pred_file, chroms=None, min_soft_score=None, columns=None):
+    """
+    Reads predictions from a Parquet file, or a directory of them, pushing the filters down to the reader.
+
+    Args:
+        pred_file (str): Parquet file or directory of Parquet files written by find_sweeps_npz.py.
+        chroms (list[str], optional): Only read these chromosomes. Defaults to all.
+        min_soft_score (float, optional): Only read windows with Soft_Score >= this. Defaults to all.
+        columns (list[str], optional): Only read these columns. Defaults to all.
+
+    Returns:
+        pd.DataFrame: Predictions, Chrom and Class are categorical.
+    """
+    filters = []
+    if chroms is not None:
+        filters.append(("Chrom", "in", list(chroms)))
+    if min_soft_score is not None:
+        filters.append(("Soft_Score", ">=", min_soft_score))
+
+    if os.path.isdir(pred_file):
+        # the csv and bed outputs live in the same directory
+        pred_file = sorted(glob(os.path.join(pred_file, "*.parquet")))
+
+    return pq.read_table(pred_file, columns=columns, filters=filters or None).to_pandas()